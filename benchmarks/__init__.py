@@ -0,0 +1 @@
+"""Benchmarks of the eSTUDNA client against an offline CML emulator."""
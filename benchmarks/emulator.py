@@ -0,0 +1,233 @@
+"""Offline emulator of the CML ThingsBoard servers.
+
+Serves both API dialects, the original eSTUDNA one under /api and the
+eSTUDNA2 one under /apiv2, with simulated devices, expiring tokens, latency
+and injected errors.
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+import jwt
+from aiohttp import web
+
+SECRET = "offline-cml-emulator-signing-secret"
+CUSTOMER_ID = "customer-1"
+USER_ID = "user-1"
+
+
+@dataclass(slots=True)
+class EmulatedDevice:
+    """Simulated well with water level and two relays."""
+
+    device_id: str
+    level: float = 1.5
+    relays: dict[str, bool] = field(
+        default_factory=lambda: {"dout1": False, "dout2": False}
+    )
+    ts: int = 0
+
+    def tick(self, now: int):
+        """Let the water level drift a little."""
+        self.level = max(0.0, self.level + random.uniform(-0.01, 0.01))
+        self.ts = now
+
+
+class CMLEmulator:
+    """Fake CML server, start it and point ThingsBoard.server to its url."""
+
+    def __init__(
+        self,
+        devices: int = 10,
+        *,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        token_lifetime: int = 900,
+    ):
+        self.devices = {
+            f"device-{index}": EmulatedDevice(f"device-{index}")
+            for index in range(devices)
+        }
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_lifetime = token_lifetime
+        # Requests per route and responses per status code
+        self.requests: Counter[str] = Counter()
+        self.statuses: Counter[int] = Counter()
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    def _app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.add_routes(
+            [
+                web.post("/api/auth/login", self._login),
+                web.post("/apiv2/auth/login", self._login),
+                web.post("/api/auth/token", self._refresh),
+                web.post("/apiv2/auth/token", self._refresh),
+                web.get("/api/auth/user", self._user),
+                web.get("/api/customer/{customer}/devices", self._devices),
+                web.get("/apiv2/user/{user}/devices", self._devices_v2),
+                web.get(
+                    "/api/plugins/telemetry/DEVICE/{device}/values/timeseries",
+                    self._timeseries,
+                ),
+                web.get("/apiv2/device/{device}/latest", self._latest_v2),
+                web.post("/api/rpc/twoway/{device}", self._rpc),
+                web.post("/apiv2/device/{device}/rpc/twoway", self._rpc),
+            ]
+        )
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """Start serving, the address is available as url afterwards."""
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # noqa: SLF001
+        self.url = f"http://{host}:{port}"
+
+    async def stop(self):
+        """Stop serving."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset_counters(self):
+        """Forget counted requests."""
+        self.requests.clear()
+        self.statuses.clear()
+
+    def _issue_tokens(self) -> dict:
+        now = int(time.time())
+        return {
+            "token": jwt.encode(
+                {"sub": USER_ID, "iat": now, "exp": now + self.token_lifetime},
+                SECRET,
+            ),
+            "refreshToken": jwt.encode(
+                {"sub": USER_ID, "iat": now, "exp": now + 7 * 24 * 3600}, SECRET
+            ),
+        }
+
+    @staticmethod
+    def _check_token(token: str):
+        try:
+            jwt.decode(token, SECRET, algorithms=["HS256"])
+        except jwt.InvalidTokenError as err:
+            raise web.HTTPUnauthorized from err
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        route = request.match_info.route.resource
+        self.requests[route.canonical if route is not None else request.path] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            if random.random() < self.error_rate:
+                raise web.HTTPServiceUnavailable
+            if not request.path.endswith(("/auth/login", "/auth/token")):
+                header = request.headers.get("X-Authorization", "")
+                self._check_token(header.removeprefix("Bearer "))
+            response = await handler(request)
+        except web.HTTPException as err:
+            self.statuses[err.status] += 1
+            raise
+        self.statuses[response.status] += 1
+        return response
+
+    async def _login(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if not body.get("username") or not body.get("password"):
+            raise web.HTTPUnauthorized
+        response = self._issue_tokens()
+        if request.path.startswith("/apiv2"):
+            response["user_id"] = USER_ID
+        return web.json_response(response)
+
+    async def _refresh(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self._check_token(body.get("refreshToken", ""))
+        return web.json_response(self._issue_tokens())
+
+    async def _user(self, request: web.Request) -> web.Response:
+        return web.json_response({"customerId": {"id": CUSTOMER_ID}})
+
+    def _device_list(self) -> list[dict]:
+        return [
+            {"id": {"id": device_id}, "name": device_id, "type": "eSTUDNA"}
+            for device_id in self.devices
+        ]
+
+    async def _devices(self, request: web.Request) -> web.Response:
+        page_size = int(request.query.get("pageSize", 100))
+        page = int(request.query.get("page", 0))
+        devices = self._device_list()
+        return web.json_response(
+            {
+                "data": devices[page * page_size : (page + 1) * page_size],
+                "hasNext": (page + 1) * page_size < len(devices),
+            }
+        )
+
+    async def _devices_v2(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            [
+                {"id": device_id, "name": device_id, "type": "eSTUDNA2"}
+                for device_id in self.devices
+            ]
+        )
+
+    def _device(self, request: web.Request) -> EmulatedDevice:
+        try:
+            device = self.devices[request.match_info["device"]]
+        except KeyError as err:
+            raise web.HTTPNotFound from err
+        device.tick(int(time.time() * 1000))
+        return device
+
+    @staticmethod
+    def _values(device: EmulatedDevice) -> dict[str, str]:
+        return {
+            "ain1": str(round(device.level, 3)),
+            "dout1": "1" if device.relays["dout1"] else "0",
+            "dout2": "1" if device.relays["dout2"] else "0",
+        }
+
+    async def _timeseries(self, request: web.Request) -> web.Response:
+        device = self._device(request)
+        keys = request.query.get("keys", "").split(",")
+        return web.json_response(
+            {
+                key: [{"ts": device.ts, "value": value}]
+                for key, value in self._values(device).items()
+                if key in keys
+            }
+        )
+
+    async def _latest_v2(self, request: web.Request) -> web.Response:
+        device = self._device(request)
+        # eSTUDNA2 nests JSON encoded values in the response
+        return web.json_response(
+            {
+                key: [{"ts": device.ts, "value": json.dumps({"str": value})}]
+                for key, value in self._values(device).items()
+            }
+        )
+
+    async def _rpc(self, request: web.Request) -> web.Response:
+        device = self._device(request)
+        body = await request.json()
+        relay = {"setDout1": "dout1", "setDout2": "dout2"}.get(body.get("method"))
+        if relay is None:
+            raise web.HTTPBadRequest
+        device.relays[relay] = bool(body.get("params"))
+        return web.json_response(device.relays[relay])
@@ -0,0 +1,198 @@
+"""Benchmark polling of the eSTUDNA client against the offline emulator.
+
+The coordinator needs Home Assistant, so this drives the ThingsBoard client
+with a simplified polling loop instead: every poll fetches a snapshot of
+each device, limited by the default concurrency. It measures the client and
+the requests, not scheduling done by the coordinator. Results are written
+as JSON to track regressions:
+
+    python -m benchmarks.run --devices 10,100,500 --output benchmark.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+import aiohttp
+
+from tests.component import estudna, load_module
+
+from .emulator import CMLEmulator
+
+const = load_module("const")
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Return percentile of values, 0 for no values."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def create_trace_config(latencies: list[float]) -> aiohttp.TraceConfig:
+    """Return trace config collecting latency of every request."""
+
+    async def on_request_start(session, context, params):
+        context.start = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        latencies.append(time.perf_counter() - context.start)
+
+    trace_config = aiohttp.TraceConfig(trace_config_ctx_factory=SimpleNamespace)
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+async def poll(thingsboard, device_ids: list[str], concurrency: int) -> int:
+    """Fetch and parse values of all devices, returns number of failures."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(device_id: str):
+        async with semaphore:
+            values = await thingsboard.get_device_snapshot(device_id)
+        thingsboard.decode_values(values)
+
+    results = await asyncio.gather(
+        *(fetch(device_id) for device_id in device_ids), return_exceptions=True
+    )
+    return sum(isinstance(result, Exception) for result in results)
+
+
+async def run_scenario(args, device_type: str, devices: int) -> dict:
+    """Benchmark polling of a number of devices using one API dialect."""
+    emulator = CMLEmulator(
+        devices,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        token_lifetime=args.token_lifetime,
+    )
+    await emulator.start()
+    latencies: list[float] = []
+    session = aiohttp.ClientSession(trace_configs=[create_trace_config(latencies)])
+    thingsboard = estudna.ThingsBoard(device_type=device_type, session=session)
+    thingsboard.server = emulator.url
+    estudna.get_request_scheduler(emulator.url).rate = args.rate
+    try:
+        await thingsboard.login("user", "password")
+        device_ids = [
+            estudna.get_device_id(device) for device in await thingsboard.get_devices()
+        ]
+
+        emulator.reset_counters()
+        latencies.clear()
+        poll_times = []
+        failures = 0
+        for _poll in range(args.polls):
+            start = time.perf_counter()
+            failures += await poll(thingsboard, device_ids, args.concurrency)
+            poll_times.append(time.perf_counter() - start)
+        requests = emulator.requests.total()
+        statuses = dict(emulator.statuses)
+
+        # Memory is traced in a separate poll, tracing slows everything down
+        tracemalloc.start()
+        await poll(thingsboard, device_ids, args.concurrency)
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        await thingsboard.close()
+        await session.close()
+        await emulator.stop()
+
+    return {
+        "device_type": device_type,
+        "devices": devices,
+        "polls": args.polls,
+        "requests_per_poll": requests / args.polls,
+        "failed_devices_per_poll": failures / args.polls,
+        "statuses": statuses,
+        "poll_time_mean": statistics.fmean(poll_times),
+        "poll_time_max": max(poll_times),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "memory_peak_kib": peak / 1024,
+    }
+
+
+async def run(args) -> dict:
+    """Run all scenarios."""
+    results = [
+        await run_scenario(args, device_type, devices)
+        for device_type in args.device_types
+        for devices in args.devices
+    ]
+    return {
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "aiohttp": aiohttp.__version__,
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "token_lifetime": args.token_lifetime,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument(
+        "--devices",
+        type=lambda value: [int(item) for item in value.split(",")],
+        default=[10, 100, 500],
+        help="comma separated numbers of simulated devices",
+    )
+    parser.add_argument(
+        "--device-types",
+        type=lambda value: value.split(","),
+        default=[const.DEVICE_TYPE_ESTUDNA, const.DEVICE_TYPE_ESTUDNA2],
+        help="comma separated API dialects",
+    )
+    parser.add_argument("--polls", type=int, default=5)
+    parser.add_argument(
+        "--concurrency", type=int, default=const.DEFAULT_MAX_CONCURRENCY
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=estudna.REQUEST_RATE,
+        help="client request rate limit per second",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="server latency in seconds"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.01, help="random extra latency in seconds"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of failing requests"
+    )
+    parser.add_argument(
+        "--token-lifetime", type=int, default=900, help="token lifetime in seconds"
+    )
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"))
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    for result in report["results"]:
+        sys.stdout.write(
+            "{device_type:9} {devices:5} devices: {requests_per_poll:7.1f} req/poll, "
+            "poll {poll_time_mean:7.3f} s, p50 {latency_p50:.4f} s, "
+            "p99 {latency_p99:.4f} s, {memory_peak_kib:9.1f} KiB\n".format(**result)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,115 +1,830 @@
 """eSTUDNA component for Home Assistant."""
 
+import asyncio
+import contextlib
 import logging
-from datetime import timedelta
+import time
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import CONF_PASSWORD, CONF_USERNAME, Platform
-from homeassistant.core import HomeAssistant
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers import device_registry as dr
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.typing import ConfigType
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+from homeassistant.util import dt as dt_util
 
-from .const import CONF_DEVICE_TYPE, DEVICE_TYPE_ESTUDNA, DOMAIN
-from .estudna import ThingsBoard
+from .config_flow import get_unique_id
+from .const import (
+    CONF_DEVICE_TYPE,
+    CONF_LEVEL_DEADBAND,
+    CONF_LEVEL_DEADBAND_PERCENT,
+    CONF_LEVEL_HEARTBEAT,
+    CONF_MAX_CONCURRENCY,
+    CONF_MAX_SCAN_INTERVAL,
+    CONF_POLL_BUDGET,
+    CONF_PUSH_UPDATES,
+    CONF_RELAY_CONFIRM_ATTEMPTS,
+    CONF_RELAY_CONFIRM_INTERVAL,
+    CONF_REQUEST_TIMEOUT,
+    CONF_SCAN_INTERVAL,
+    DATA_CLIENTS,
+    DEFAULT_LEVEL_DEADBAND,
+    DEFAULT_LEVEL_DEADBAND_PERCENT,
+    DEFAULT_LEVEL_HEARTBEAT,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_MAX_SCAN_INTERVAL,
+    DEFAULT_POLL_BUDGET,
+    DEFAULT_SCAN_INTERVAL,
+    DEVICE_TYPE_ESTUDNA,
+    DEVICE_TYPE_ESTUDNA2,
+    DOMAIN,
+    RELAY_CONFIRM_ATTEMPTS,
+    RELAY_CONFIRM_INTERVAL,
+    STORAGE_SAVE_DELAY,
+    STORAGE_VERSION,
+    WINDOW_DAY,
+    WINDOW_HOUR,
+)
+from .estudna import (
+    LEVEL_KEY,
+    PRIORITY_POLL,
+    PRIORITY_REFRESH,
+    RELAY_KEYS,
+    REQUEST_TIMEOUT,
+    TelemetrySubscription,
+    ThingsBoard,
+    get_device_id,
+    get_server,
+)
+from .history import async_import_level_statistics
+from .services import async_setup_services
 
 _LOGGER = logging.getLogger(__name__)
 
 PLATFORMS = [Platform.SENSOR, Platform.SWITCH]
-SCAN_INTERVAL = timedelta(seconds=60)
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+# Bounds of adaptive polling interval of each device
+MIN_SCAN_INTERVAL = timedelta(seconds=DEFAULT_SCAN_INTERVAL)
+MAX_SCAN_INTERVAL = timedelta(minutes=DEFAULT_MAX_SCAN_INTERVAL)
+# Safety-net polling when live updates are pushed over WebSocket
+PUSH_SCAN_INTERVAL = timedelta(minutes=15)
+# Maximal age of last known values served when fetching fails
+MAX_STALENESS = timedelta(minutes=15)
+# Time budget of a poll, devices not fetched within it are polled next time
+POLL_BUDGET = timedelta(seconds=DEFAULT_POLL_BUDGET)
+# Rediscovery of devices added to or removed from the account
+DEVICE_SCAN_INTERVAL = timedelta(hours=1)
+# Check for completed aggregation windows of level change sensors
+AGGREGATE_SCAN_INTERVAL = timedelta(minutes=5)
+# Import of level history into long-term statistics
+HISTORY_IMPORT_INTERVAL = timedelta(hours=1)
 
 
-def get_device_id(device: dict) -> str:
-    """Extract device ID from device dict.
+def get_store(hass: HomeAssistant, entry: ConfigEntry) -> Store:
+    """Return store holding session and devices for a config entry."""
+    return Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry.entry_id}")
 
-    eSTUDNA2 has device["id"] as string, eSTUDNA has device["id"]["id"].
+
+@dataclass(slots=True)
+class DeviceState:
+    """Last known values of a device.
+
+    States are updated in place, so entities can keep a reference.
     """
-    if isinstance(device["id"], dict):
-        return device["id"]["id"]
-    return device["id"]
+
+    device_id: str
+    level: float | None = None
+    level_ts: int | None = None
+    relays: dict[str, bool] = field(default_factory=dict)
+    relay_ts: dict[str, int | None] = field(default_factory=dict)
+    # Error of the last failed fetch, None once fetching succeeds
+    error: str | None = None
+    # Values changed by the last update, "level" or relay names
+    changed: set[str] = field(default_factory=set)
+
+    def set_level(self, level: float | None, timestamp: int | None):
+        """Update level, a reading with known timestamp is not new."""
+        if timestamp is not None and timestamp == self.level_ts:
+            return
+        if level != self.level:
+            self.changed.add("level")
+        self.level = level
+        self.level_ts = timestamp
+
+    def set_relay(self, relay: str, state: bool, timestamp: int | None):
+        """Update relay state, a reading with known timestamp is not new."""
+        if timestamp is not None and timestamp == self.relay_ts.get(relay):
+            return
+        if relay not in self.relays or self.relays[relay] != state:
+            self.changed.add(relay)
+        self.relays[relay] = state
+        self.relay_ts[relay] = timestamp
 
 
 class EStudnaCoordinator(DataUpdateCoordinator):
     """Class to manage fetching eSTUDNA data."""
 
     def __init__(
-        self, hass: HomeAssistant, thingsboard: ThingsBoard, devices: list[dict]
+        self,
+        hass: HomeAssistant,
+        thingsboard: ThingsBoard,
+        devices: list[dict],
+        *,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        min_interval: timedelta = MIN_SCAN_INTERVAL,
+        max_interval: timedelta = MAX_SCAN_INTERVAL,
+        max_staleness: timedelta = MAX_STALENESS,
+        poll_budget: timedelta = POLL_BUDGET,
+        push_updates: bool = False,
     ):
-        """Initialize coordinator."""
+        """Initialize coordinator.
+
+        Each device is polled between min_interval and max_interval, faster
+        while its values change and slower while they stay the same. A poll
+        ends after poll_budget, with the devices fetched so far. With
+        push_updates, polling is only a safety net at PUSH_SCAN_INTERVAL.
+        """
+        if push_updates:
+            min_interval = max_interval = PUSH_SCAN_INTERVAL
         super().__init__(
             hass,
             _LOGGER,
             name=DOMAIN,
-            update_interval=SCAN_INTERVAL,
+            update_interval=min_interval,
         )
         self.thingsboard = thingsboard
         self.devices = devices
+        # Coordinator data, updated in place
+        self.states = {
+            device_id: DeviceState(device_id)
+            for device_id in map(get_device_id, devices)
+        }
+        self.min_interval = min_interval.total_seconds()
+        self.max_interval = max_interval.total_seconds()
+        self.push_updates = push_updates
+        # How long to serve last known values when fetching fails
+        self.max_staleness = max_staleness.total_seconds()
+        self.poll_budget = poll_budget.total_seconds()
+        self._last_success: dict[str, float] = {}
+        # Current polling interval and monotonic time of next poll per device
+        self._poll_interval: dict[str, float] = {}
+        self._next_poll: dict[str, float] = {}
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Polling of a device until it reports a switched relay
+        self.relay_confirm_interval: float = RELAY_CONFIRM_INTERVAL
+        self.relay_confirm_attempts = RELAY_CONFIRM_ATTEMPTS
+        self._subscription: TelemetrySubscription | None = None
+        self.aggregates: EStudnaAggregateCoordinator | None = None
+        # Server and username the coordinator is shared under
+        self.client_key: tuple[str, str] | None = None
+        self.entry_ids: set[str] = set()
+        # Level changes smaller than the deadband are written to the state
+        # only after the heartbeat (seconds)
+        self.level_deadband = DEFAULT_LEVEL_DEADBAND
+        self.level_deadband_percent = DEFAULT_LEVEL_DEADBAND_PERCENT
+        self.level_heartbeat = DEFAULT_LEVEL_HEARTBEAT * 60.0
+        # Statistics of the last poll, shown by diagnostic sensors
+        self.last_poll_duration: float | None = None
+        self.last_poll_requests: int | None = None
+        self.last_poll_success: datetime | None = None
+        self._device_listeners: list[Callable[[list[dict]], None]] = []
+        # Called when the list of devices changes, for example to persist it
+        self.devices_changed: Callable[[], None] | None = None
+        # End of the range checked for level history per device, UNIX timestamp
+        self.history_checked: dict[str, float] = {}
+        # Called when history_checked changes, for example to persist it
+        self.history_changed: Callable[[], None] | None = None
+
+    @callback
+    def async_apply_options(self, options: Mapping[str, Any]):
+        """Apply config entry options to the running coordinator.
+
+        Requests already in flight finish with the previous settings.
+        """
+        self.level_deadband = options.get(CONF_LEVEL_DEADBAND, DEFAULT_LEVEL_DEADBAND)
+        self.level_deadband_percent = options.get(
+            CONF_LEVEL_DEADBAND_PERCENT, DEFAULT_LEVEL_DEADBAND_PERCENT
+        )
+        self.level_heartbeat = (
+            options.get(CONF_LEVEL_HEARTBEAT, DEFAULT_LEVEL_HEARTBEAT) * 60.0
+        )
+        if not self.push_updates:
+            self.min_interval = float(
+                options.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
+            )
+            self.max_interval = max(
+                options.get(CONF_MAX_SCAN_INTERVAL, DEFAULT_MAX_SCAN_INTERVAL) * 60.0,
+                self.min_interval,
+            )
+            self.update_interval = timedelta(seconds=self.min_interval)
+            # Keep intervals of devices within the new bounds
+            now = time.monotonic()
+            for device_id, interval in self._poll_interval.items():
+                interval = min(max(interval, self.min_interval), self.max_interval)
+                self._poll_interval[device_id] = interval
+                self._next_poll[device_id] = min(
+                    self._next_poll.get(device_id, now), now + interval
+                )
+        max_concurrency = int(
+            options.get(CONF_MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY)
+        )
+        if max_concurrency != self.max_concurrency:
+            # Fetches waiting on the previous semaphore finish with it
+            self.max_concurrency = max_concurrency
+            self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.poll_budget = float(options.get(CONF_POLL_BUDGET, DEFAULT_POLL_BUDGET))
+        self.thingsboard.timeout = float(
+            options.get(CONF_REQUEST_TIMEOUT, REQUEST_TIMEOUT)
+        )
+        self.relay_confirm_interval = options.get(
+            CONF_RELAY_CONFIRM_INTERVAL, RELAY_CONFIRM_INTERVAL
+        )
+        self.relay_confirm_attempts = int(
+            options.get(CONF_RELAY_CONFIRM_ATTEMPTS, RELAY_CONFIRM_ATTEMPTS)
+        )
+
+    @callback
+    def async_add_device_listener(
+        self, listener: Callable[[list[dict]], None]
+    ) -> CALLBACK_TYPE:
+        """Register a listener called with newly discovered devices."""
+        self._device_listeners.append(listener)
+        return lambda: self._device_listeners.remove(listener)
+
+    async def async_rediscover_devices(self, _now=None):
+        """Rediscover devices in the background."""
+        try:
+            changed = await self.async_refresh_devices()
+        except Exception as err:  # noqa: BLE001
+            _LOGGER.debug("Error rediscovering devices: %s", err)
+            return
+        if changed and self.devices_changed is not None:
+            self.devices_changed()
+
+    async def async_refresh_devices(self) -> bool:
+        """Rediscover devices, add new ones and remove vanished ones.
+
+        Returns whether the list of devices has changed.
+        """
+        current = {get_device_id(device): device for device in self.devices}
+        discovered = {
+            get_device_id(device): device
+            for device in await self.thingsboard.get_devices()
+        }
+        added = [
+            device
+            for device_id, device in discovered.items()
+            if device_id not in current
+        ]
+        removed = [device_id for device_id in current if device_id not in discovered]
+        if not added and not removed:
+            return False
+
+        for device_id in removed:
+            self.states.pop(device_id, None)
+            self._poll_interval.pop(device_id, None)
+            self._next_poll.pop(device_id, None)
+            self._last_success.pop(device_id, None)
+
+        _LOGGER.debug(
+            "Discovered %d new devices, %d devices removed", len(added), len(removed)
+        )
+        # Keep existing device dicts as entities reference them
+        self.devices[:] = [
+            current.get(device_id, device) for device_id, device in discovered.items()
+        ]
+        self.states = {
+            device_id: self.states.get(device_id) or DeviceState(device_id)
+            for device_id in discovered
+        }
+
+        device_registry = dr.async_get(self.hass)
+        for device_id in removed:
+            if device := device_registry.async_get_device(
+                identifiers={(DOMAIN, device_id)}
+            ):
+                device_registry.async_update_device(
+                    device.id, remove_config_entry_id=self.config_entry.entry_id
+                )
+
+        if self._subscription is not None:
+            await self.async_stop_push()
+            self.async_start_push()
+
+        if added:
+            for listener in self._device_listeners:
+                listener(added)
+            await self.async_request_refresh()
+        return True
+
+    async def async_import_history(self, _now=None):
+        """Import level history into long-term statistics."""
+        checked = dict(self.history_checked)
+        try:
+            await async_import_level_statistics(
+                self.hass,
+                self.thingsboard,
+                {get_device_id(device): device.get("name") for device in self.devices},
+                self.history_checked,
+            )
+        except Exception as err:  # noqa: BLE001
+            _LOGGER.debug("Error importing level history: %s", err)
+        if self.history_checked != checked and self.history_changed is not None:
+            self.history_changed()
+
+    @callback
+    def async_start_push(self):
+        """Start receiving live telemetry updates."""
+        self._subscription = TelemetrySubscription(
+            self.thingsboard,
+            [get_device_id(device) for device in self.devices],
+            self.async_handle_push,
+        )
+        self._subscription.start()
+
+    async def async_stop_push(self):
+        """Stop receiving live telemetry updates."""
+        if self._subscription is not None:
+            await self._subscription.stop()
+            self._subscription = None
+
+    @callback
+    def async_handle_push(self, device_id: str, values: dict):
+        """Merge pushed telemetry into coordinator data."""
+        if (state := self.states.get(device_id)) is None:
+            return
+        self._reset_changed()
+        self._update_state(state, values, partial=True)
+        self._last_success[device_id] = time.monotonic()
+        self.async_set_updated_data(self.states)
+
+    def _reset_changed(self):
+        """Forget changes of the previous update."""
+        for state in self.states.values():
+            state.changed.clear()
+
+    def _schedule_next_poll(self, device_id: str, changed: bool, now: float):
+        """Shorten polling interval on change, back off exponentially otherwise."""
+        if changed:
+            interval = self.min_interval
+        else:
+            interval = min(
+                self._poll_interval.get(device_id, self.min_interval) * 2,
+                self.max_interval,
+            )
+        self._poll_interval[device_id] = interval
+        self._next_poll[device_id] = now + interval
+
+    def _update_state(self, state: DeviceState, values: dict, partial: bool = False):
+        """Decode device values into its state.
+
+        With partial, only keys present in values are updated.
+        """
+        state.error = None
+        decoded = self.thingsboard.decode_values(values)
+        if not partial or LEVEL_KEY in decoded:
+            state.set_level(*decoded.get(LEVEL_KEY, (None, None)))
+        for relay, key in RELAY_KEYS.items():
+            if not partial or key in decoded:
+                state.set_relay(relay, *decoded.get(key, (False, None)))
+
+    def _expire_state(self, state: DeviceState, now: float):
+        """Forget last known values of a device if they are too old."""
+        last_success = self._last_success.get(state.device_id)
+        if last_success is not None and now - last_success <= self.max_staleness:
+            return
+        state.set_level(None, None)
+        for relay in RELAY_KEYS:
+            state.set_relay(relay, False, None)
+
+    async def async_refresh_device(self, device_id: str) -> dict | None:
+        """Fetch a single device and merge its values into coordinator data.
+
+        Returns fetched values or None on failure.
+        """
+        return (await self.async_refresh_selected([device_id]))[0]
+
+    async def async_refresh_selected(self, device_ids: list[str]) -> list[dict | None]:
+        """Fetch given devices and merge their values into coordinator data.
+
+        Listeners are notified once. Returns fetched values of each device,
+        None for failed ones.
+        """
+        now = time.monotonic()
+        results = await asyncio.gather(
+            *(
+                self._async_fetch_device(device_id, PRIORITY_REFRESH)
+                for device_id in device_ids
+            )
+        )
+        if all(result is None for result in results):
+            return results
+        self._reset_changed()
+        for device_id, result in zip(device_ids, results, strict=True):
+            if result is None or (state := self.states.get(device_id)) is None:
+                continue
+            self._update_state(state, result)
+            self._last_success[device_id] = now
+            # Poll often after an interaction with the device
+            self._schedule_next_poll(device_id, True, now)
+        self.async_set_updated_data(self.states)
+        return results
+
+    def get_diagnostics(self) -> dict:
+        """Return polling state for diagnostics."""
+        now = time.monotonic()
+        return {
+            "min_interval": self.min_interval,
+            "max_interval": self.max_interval,
+            "max_concurrency": self.max_concurrency,
+            "poll_budget": self.poll_budget,
+            "request_timeout": self.thingsboard.timeout,
+            "push": self._subscription is not None,
+            "circuit_open": self.thingsboard.circuit_open,
+            "queued_requests": self.thingsboard.scheduler.queued,
+            "last_poll_duration": self.last_poll_duration,
+            "last_poll_requests": self.last_poll_requests,
+            "last_poll_success": self.last_poll_success,
+            "devices": {
+                device_id: {
+                    "level": state.level,
+                    "relays": state.relays,
+                    "error": state.error,
+                    "poll_interval": self._poll_interval.get(device_id),
+                    "next_poll_in": self._next_poll[device_id] - now
+                    if device_id in self._next_poll
+                    else None,
+                }
+                for device_id, state in self.states.items()
+            },
+        }
+
+    def _get_request_timeout(self, deadline: float | None) -> float | None:
+        """Return request timeout ending at latest with the deadline."""
+        if deadline is None:
+            return None
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            # Do not send requests that cannot finish in time
+            raise TimeoutError("Poll deadline exceeded")
+        return min(self.thingsboard.timeout, timeout)
+
+    async def _async_fetch_device(
+        self,
+        device_id: str,
+        priority: int = PRIORITY_POLL,
+        deadline: float | None = None,
+    ) -> dict | None:
+        """Fetch values of a single device, returns None on failure.
+
+        The request timeout is limited by the monotonic deadline if given,
+        TimeoutError is raised once the deadline is reached.
+        """
+        # Only background polling is limited, on-demand refreshes are
+        # prioritized by the request scheduler instead
+        semaphore = (
+            self._semaphore if priority == PRIORITY_POLL else contextlib.nullcontext()
+        )
+        # Fetch all telemetry keys with a single request
+        try:
+            async with semaphore:
+                return await self.thingsboard.get_device_snapshot(
+                    device_id,
+                    priority=priority,
+                    timeout=self._get_request_timeout(deadline),
+                )
+        except TimeoutError as err:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+            error = str(err) or "Request timed out"
+        except Exception as err:  # noqa: BLE001
+            error = str(err) or type(err).__name__
+        _LOGGER.debug("Error fetching values for device %s: %s", device_id, error)
+        if (state := self.states.get(device_id)) is not None:
+            state.error = error
+        return None
 
     async def _async_update_data(self):
         """Fetch data from API."""
-        data = {}
-        for device in self.devices:
-            device_id = get_device_id(device)
-            # Fetch sensor level
-            try:
-                level = await self.thingsboard.get_estudna_level(device_id)
-                data[f"{device_id}_level"] = level
-            except Exception as err:  # noqa: BLE001
-                _LOGGER.debug("Error fetching level for device %s: %s", device_id, err)
-                data[f"{device_id}_level"] = None
-
-            # Fetch relay states
-            for relay in ["OUT1", "OUT2"]:
-                try:
-                    state = await self.thingsboard.get_relay_state(device_id, relay)
-                    data[f"{device_id}_{relay}"] = state
-                except Exception as err:  # noqa: BLE001
-                    _LOGGER.debug(
-                        "Error fetching relay %s state for device %s: %s",
-                        relay,
-                        device_id,
-                        err,
-                    )
-                    data[f"{device_id}_{relay}"] = False
+        if self.data is not None and self.thingsboard.circuit_open:
+            _LOGGER.debug("Server is failing, keeping last known values")
+            self._reset_changed()
+            return self.states
 
+        start = time.monotonic()
+        requests = self.thingsboard.stats.requests
+        # Allow small scheduling jitter so devices are not skipped a whole tick,
+        # the most overdue devices are fetched first so that devices left over
+        # by a poll exceeding its budget are not starved
+        due = sorted(
+            (
+                state
+                for device_id, state in self.states.items()
+                if self._next_poll.get(device_id, 0) <= start + 1
+            ),
+            key=lambda state: self._next_poll.get(state.device_id, 0),
+        )
+        deadline = start + self.poll_budget
+        tasks = [
+            asyncio.create_task(
+                self._async_fetch_device(state.device_id, deadline=deadline)
+            )
+            for state in due
+        ]
+        pending = set()
+        if tasks:
+            _done, pending = await asyncio.wait(tasks, timeout=self.poll_budget)
+        if pending:
+            # Publish what was fetched within the budget
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+        self._reset_changed()
+        fetched = timed_out = 0
+        for state, task in zip(due, tasks, strict=True):
+            device_id = state.device_id
+            if task.cancelled() or task.exception() is not None:
+                # Serve cached values, the device stays overdue and is polled
+                # first next time
+                state.error = "Poll deadline exceeded"
+                self._expire_state(state, start)
+                timed_out += 1
+            elif (result := task.result()) is None:
+                # Serve cached values and keep the interval unchanged
+                self._expire_state(state, start)
+                self._next_poll[device_id] = start + self._poll_interval.get(
+                    device_id, self.min_interval
+                )
+            else:
+                self._update_state(state, result)
+                self._last_success[device_id] = start
+                self._schedule_next_poll(device_id, bool(state.changed), start)
+                fetched += 1
+        self.last_poll_duration = time.monotonic() - start
+        self.last_poll_requests = self.thingsboard.stats.requests - requests
+        if fetched:
+            self.last_poll_success = dt_util.utcnow()
+        _LOGGER.debug(
+            "Fetched %d of %d devices with %d requests in %.3f s, %d timed out",
+            fetched,
+            len(self.devices),
+            self.last_poll_requests,
+            self.last_poll_duration,
+            timed_out,
+        )
+        return self.states
+
+
+class EStudnaAggregateCoordinator(DataUpdateCoordinator):
+    """Class to manage fetching level change over past hour and day.
+
+    Values are aggregated by the server and fetched once per window.
+    """
+
+    def __init__(self, hass: HomeAssistant, coordinator: EStudnaCoordinator):
+        """Initialize coordinator."""
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{DOMAIN} aggregates",
+            update_interval=AGGREGATE_SCAN_INTERVAL,
+        )
+        self.coordinator = coordinator
+        # Start of the window and its result per device and window
+        self._cache: dict[tuple[str, str], tuple[datetime, tuple | None]] = {}
+
+    async def _async_update_data(self):
+        """Fetch level change of completed windows."""
+        now = dt_util.now()
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        day = dt_util.start_of_local_day(now)
+        windows = {
+            WINDOW_HOUR: (hour - timedelta(hours=1), hour),
+            WINDOW_DAY: (day - timedelta(days=1), day),
+        }
+        data: dict[str, dict[str, tuple | None]] = {}
+        for device_id in self.coordinator.states:
+            for window, (start, end) in windows.items():
+                key = (device_id, window)
+                cached = self._cache.get(key)
+                if cached is None or cached[0] != start:
+                    try:
+                        result = await self.coordinator.thingsboard.get_level_change(
+                            device_id,
+                            int(start.timestamp() * 1000),
+                            int(end.timestamp() * 1000),
+                        )
+                    except Exception as err:  # noqa: BLE001
+                        _LOGGER.debug(
+                            "Error fetching level change for device %s: %s",
+                            device_id,
+                            err,
+                        )
+                        # Keep the previous window, it is retried on next update
+                        if cached is None:
+                            continue
+                    else:
+                        cached = self._cache[key] = (start, result)
+                data.setdefault(device_id, {})[window] = cached[1]
         return data
 
 
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """Set up estudna services."""
+    async_setup_services(hass)
+    return True
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up estudna from a config entry."""
 
     hass.data.setdefault(DOMAIN, {})
+    clients = hass.data[DOMAIN].setdefault(DATA_CLIENTS, {})
     device_type = entry.data.get(CONF_DEVICE_TYPE, DEVICE_TYPE_ESTUDNA)
+    client_key = (get_server(device_type), entry.data[CONF_USERNAME].lower())
 
-    # Get shared aiohttp session
-    session = async_get_clientsession(hass)
-
-    # Initialize ThingsBoard with async session
-    tb = ThingsBoard(device_type=device_type, session=session)
+    if (coordinator := clients.get(client_key)) is not None:
+        # Same account in several entries, share the connection and polling
+        _LOGGER.warning(
+            "Account %s is configured more than once, please remove duplicate entries",
+            entry.data[CONF_USERNAME],
+        )
+        coordinator.entry_ids.add(entry.entry_id)
+        hass.data[DOMAIN][entry.entry_id] = coordinator
+        return True
 
-    # Login using async method
-    await tb.login(entry.data[CONF_USERNAME], entry.data[CONF_PASSWORD])
+    if entry.unique_id is None:
+        # Entries created before unique IDs were introduced
+        hass.config_entries.async_update_entry(
+            entry, unique_id=get_unique_id(entry.data)
+        )
 
-    # Get devices
-    devices = await tb.get_devices()
+    store = get_store(hass, entry)
+    tb, devices, stored = await async_create_client(hass, entry, store)
 
     # Create coordinator
-    coordinator = EStudnaCoordinator(hass, tb, devices)
+    push_updates = entry.data.get(CONF_PUSH_UPDATES, False)
+    coordinator = EStudnaCoordinator(hass, tb, devices, push_updates=push_updates)
+    coordinator.client_key = client_key
+    try:
+        await async_setup_coordinator(hass, entry, coordinator, store, stored)
+    except BaseException:
+        # Setup is retried with a new client, stop everything of this one
+        if clients.get(client_key) is coordinator:
+            del clients[client_key]
+            hass.data[DOMAIN].pop(entry.entry_id, None)
+        await coordinator.async_stop_push()
+        await tb.close()
+        raise
+
+    return True
+
+
+async def async_setup_coordinator(
+    hass: HomeAssistant,
+    entry: ConfigEntry,
+    coordinator: EStudnaCoordinator,
+    store: Store,
+    stored: dict | None,
+) -> None:
+    """Fetch initial data, start background updates and set up platforms."""
+    tb = coordinator.thingsboard
+    coordinator.entry_ids.add(entry.entry_id)
+    coordinator.async_apply_options(entry.options)
+    entry.async_on_unload(entry.add_update_listener(async_update_options))
+    if stored:
+        coordinator.history_checked = stored.get("history", {})
+
+    @callback
+    def save_session():
+        store.async_delay_save(
+            lambda: {
+                "session": tb.export_session(),
+                "devices": coordinator.devices,
+                "history": coordinator.history_checked,
+            },
+            STORAGE_SAVE_DELAY,
+        )
+
+    tb.tokens_updated = save_session
+    coordinator.devices_changed = save_session
+    coordinator.history_changed = save_session
+    if not stored:
+        save_session()
 
     # Fetch initial data
     await coordinator.async_config_entry_first_refresh()
 
+    if tb.device_type != DEVICE_TYPE_ESTUDNA2:
+        # Level history is only available with the original API
+        coordinator.aggregates = EStudnaAggregateCoordinator(hass, coordinator)
+        entry.async_create_background_task(
+            hass, coordinator.aggregates.async_refresh(), "estudna aggregates"
+        )
+
+    if coordinator.push_updates:
+        coordinator.async_start_push()
+
     # Store coordinator
     hass.data[DOMAIN][entry.entry_id] = coordinator
+    hass.data[DOMAIN][DATA_CLIENTS][coordinator.client_key] = coordinator
 
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
-    return True
+    entry.async_on_unload(
+        async_track_time_interval(
+            hass, coordinator.async_rediscover_devices, DEVICE_SCAN_INTERVAL
+        )
+    )
+    if stored:
+        # Devices were loaded from storage, check for changes in the background
+        entry.async_create_background_task(
+            hass, coordinator.async_rediscover_devices(), "estudna rediscover devices"
+        )
+
+    entry.async_on_unload(
+        async_track_time_interval(
+            hass, coordinator.async_import_history, HISTORY_IMPORT_INTERVAL
+        )
+    )
+    entry.async_create_background_task(
+        hass, coordinator.async_import_history(), "estudna import history"
+    )
+
+
+async def async_update_options(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Apply changed options without reloading the entry."""
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    if coordinator.config_entry is entry:
+        coordinator.async_apply_options(entry.options)
+        # Poll devices that are due with the new settings, this also
+        # reschedules polling and updates entities
+        await coordinator.async_request_refresh()
+
+
+async def async_create_client(
+    hass: HomeAssistant, entry: ConfigEntry, store: Store
+) -> tuple[ThingsBoard, list[dict], dict | None]:
+    """Create logged in client, returns it with devices and stored data."""
+    device_type = entry.data.get(CONF_DEVICE_TYPE, DEVICE_TYPE_ESTUDNA)
+
+    # Get shared aiohttp session
+    session = async_get_clientsession(hass)
+
+    # Initialize ThingsBoard with async session
+    tb = ThingsBoard(device_type=device_type, session=session)
+
+    try:
+        if stored := await store.async_load():
+            # Reuse session from previous run, tokens are refreshed when rejected
+            tb.restore_session(
+                entry.data[CONF_USERNAME], entry.data[CONF_PASSWORD], stored["session"]
+            )
+            devices = stored["devices"]
+        else:
+            # Login using async method
+            await tb.login(entry.data[CONF_USERNAME], entry.data[CONF_PASSWORD])
+
+            # Get devices
+            devices = await tb.get_devices()
+    except BaseException:
+        # Login and restoring the session schedule a token refresh, cancel it
+        await tb.close()
+        raise
+
+    return tb, devices, stored
 
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    if coordinator.config_entry is not entry:
+        # Entry only shares coordinator of another one
+        coordinator.entry_ids.discard(entry.entry_id)
+        hass.data[DOMAIN].pop(entry.entry_id)
+        return True
+
     if unload_ok := await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
-        coordinator = hass.data[DOMAIN].pop(entry.entry_id)
+        hass.data[DOMAIN].pop(entry.entry_id)
+        hass.data[DOMAIN][DATA_CLIENTS].pop(coordinator.client_key)
+        await coordinator.async_stop_push()
         await coordinator.thingsboard.close()
+        # Let another entry of the same account take over
+        for entry_id in coordinator.entry_ids - {entry.entry_id}:
+            hass.config_entries.async_schedule_reload(entry_id)
 
     return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Remove stored session when a config entry is removed."""
+    await get_store(hass, entry).async_remove()
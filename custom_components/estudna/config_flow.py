@@ -7,18 +7,46 @@ import aiohttp
 import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.selector import (
+    NumberSelector,
+    NumberSelectorConfig,
+    NumberSelectorMode,
     SelectSelector,
     SelectSelectorConfig,
     SelectSelectorMode,
 )
 
-from .const import CONF_DEVICE_TYPE, DEVICE_TYPE_ESTUDNA, DEVICE_TYPE_ESTUDNA2, DOMAIN
-from .estudna import ThingsBoard
+from .const import (
+    CONF_DEVICE_TYPE,
+    CONF_LEVEL_DEADBAND,
+    CONF_LEVEL_DEADBAND_PERCENT,
+    CONF_LEVEL_HEARTBEAT,
+    CONF_MAX_CONCURRENCY,
+    CONF_MAX_SCAN_INTERVAL,
+    CONF_POLL_BUDGET,
+    CONF_PUSH_UPDATES,
+    CONF_RELAY_CONFIRM_ATTEMPTS,
+    CONF_RELAY_CONFIRM_INTERVAL,
+    CONF_REQUEST_TIMEOUT,
+    CONF_SCAN_INTERVAL,
+    DEFAULT_LEVEL_DEADBAND,
+    DEFAULT_LEVEL_DEADBAND_PERCENT,
+    DEFAULT_LEVEL_HEARTBEAT,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_MAX_SCAN_INTERVAL,
+    DEFAULT_POLL_BUDGET,
+    DEFAULT_SCAN_INTERVAL,
+    DEVICE_TYPE_ESTUDNA,
+    DEVICE_TYPE_ESTUDNA2,
+    DOMAIN,
+    RELAY_CONFIRM_ATTEMPTS,
+    RELAY_CONFIRM_INTERVAL,
+)
+from .estudna import REQUEST_TIMEOUT, ThingsBoard
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -35,10 +63,101 @@ STEP_USER_DATA_SCHEMA = vol.Schema(
                 mode=SelectSelectorMode.DROPDOWN,
             )
         ),
+        vol.Optional(CONF_PUSH_UPDATES, default=False): bool,
     }
 )
 
 
+def get_number_selector(
+    minimum: float, maximum: float, unit: str | None = None, step: float = 1
+) -> NumberSelector:
+    """Return selector of a number typed into a box."""
+    return NumberSelector(
+        NumberSelectorConfig(
+            min=minimum,
+            max=maximum,
+            step=step,
+            unit_of_measurement=unit,
+            mode=NumberSelectorMode.BOX,
+        )
+    )
+
+
+def get_options_schema(
+    options: dict[str, Any], push_updates: bool = False
+) -> vol.Schema:
+    """Return schema of options with current values as defaults.
+
+    Polling intervals are not offered with push updates, polling is then
+    only a safety net.
+    """
+    schema = {}
+    if not push_updates:
+        schema.update(
+            {
+                vol.Required(
+                    CONF_SCAN_INTERVAL,
+                    default=options.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL),
+                ): get_number_selector(10, 3600, "s"),
+                vol.Required(
+                    CONF_MAX_SCAN_INTERVAL,
+                    default=options.get(
+                        CONF_MAX_SCAN_INTERVAL, DEFAULT_MAX_SCAN_INTERVAL
+                    ),
+                ): get_number_selector(1, 120, "min"),
+            }
+        )
+    schema.update(
+        {
+            vol.Required(
+                CONF_MAX_CONCURRENCY,
+                default=options.get(CONF_MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY),
+            ): get_number_selector(1, 20),
+            vol.Required(
+                CONF_REQUEST_TIMEOUT,
+                default=options.get(CONF_REQUEST_TIMEOUT, REQUEST_TIMEOUT),
+            ): get_number_selector(5, 120, "s"),
+            vol.Required(
+                CONF_POLL_BUDGET,
+                default=options.get(CONF_POLL_BUDGET, DEFAULT_POLL_BUDGET),
+            ): get_number_selector(5, 300, "s"),
+            vol.Required(
+                CONF_RELAY_CONFIRM_INTERVAL,
+                default=options.get(
+                    CONF_RELAY_CONFIRM_INTERVAL, RELAY_CONFIRM_INTERVAL
+                ),
+            ): get_number_selector(0.5, 30, "s", step=0.5),
+            vol.Required(
+                CONF_RELAY_CONFIRM_ATTEMPTS,
+                default=options.get(
+                    CONF_RELAY_CONFIRM_ATTEMPTS, RELAY_CONFIRM_ATTEMPTS
+                ),
+            ): get_number_selector(1, 20),
+            vol.Required(
+                CONF_LEVEL_DEADBAND,
+                default=options.get(CONF_LEVEL_DEADBAND, DEFAULT_LEVEL_DEADBAND),
+            ): get_number_selector(0, 1, "m", step=0.001),
+            vol.Required(
+                CONF_LEVEL_DEADBAND_PERCENT,
+                default=options.get(
+                    CONF_LEVEL_DEADBAND_PERCENT, DEFAULT_LEVEL_DEADBAND_PERCENT
+                ),
+            ): get_number_selector(0, 50, "%", step=0.1),
+            vol.Required(
+                CONF_LEVEL_HEARTBEAT,
+                default=options.get(CONF_LEVEL_HEARTBEAT, DEFAULT_LEVEL_HEARTBEAT),
+            ): get_number_selector(1, 1440, "min"),
+        }
+    )
+    return vol.Schema(schema)
+
+
+def get_unique_id(data: dict[str, Any]) -> str:
+    """Return unique ID of the account, there is one per server."""
+    device_type = data.get(CONF_DEVICE_TYPE, DEVICE_TYPE_ESTUDNA)
+    return f"{device_type}_{data[CONF_USERNAME].lower()}"
+
+
 async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str, Any]:
     """Validate the user input allows us to connect.
 
@@ -59,6 +178,8 @@ async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str,
         raise CannotConnect from error
     except (RuntimeError, ValueError) as error:
         raise InvalidAuth from error
+    finally:
+        await tb.close()
 
 
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
@@ -66,6 +187,14 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     VERSION = 1
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(
+        config_entry: config_entries.ConfigEntry,
+    ) -> config_entries.OptionsFlow:
+        """Create the options flow."""
+        return OptionsFlowHandler()
+
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
@@ -75,6 +204,9 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 step_id="user", data_schema=STEP_USER_DATA_SCHEMA
             )
 
+        await self.async_set_unique_id(get_unique_id(user_input))
+        self._abort_if_unique_id_configured()
+
         errors = {}
 
         try:
@@ -94,6 +226,25 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         )
 
 
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    """Handle options of estudna, applied without reloading the entry."""
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage the options."""
+        if user_input is not None:
+            return self.async_create_entry(data=user_input)
+
+        return self.async_show_form(
+            step_id="init",
+            data_schema=get_options_schema(
+                dict(self.config_entry.options),
+                self.config_entry.data.get(CONF_PUSH_UPDATES, False),
+            ),
+        )
+
+
 class CannotConnect(HomeAssistantError):
     """Error to indicate we cannot connect."""
 
@@ -2,5 +2,57 @@
 
 DOMAIN = "estudna"
 CONF_DEVICE_TYPE = "device_type"
+CONF_PUSH_UPDATES = "push_updates"
 DEVICE_TYPE_ESTUDNA = "estudna"
 DEVICE_TYPE_ESTUDNA2 = "estudna2"
+ATTR_LAST_READING = "last_reading"
+
+# Options filtering insignificant level changes, the deadband is in metres
+# and percent of the level, the heartbeat in minutes
+CONF_LEVEL_DEADBAND = "level_deadband"
+CONF_LEVEL_DEADBAND_PERCENT = "level_deadband_percent"
+CONF_LEVEL_HEARTBEAT = "level_heartbeat"
+DEFAULT_LEVEL_DEADBAND = 0.005
+DEFAULT_LEVEL_DEADBAND_PERCENT = 0.0
+DEFAULT_LEVEL_HEARTBEAT = 60
+
+# Options tuning polling and requests, applied to the running coordinator
+CONF_SCAN_INTERVAL = "scan_interval"
+CONF_MAX_SCAN_INTERVAL = "max_scan_interval"
+CONF_MAX_CONCURRENCY = "max_concurrency"
+CONF_REQUEST_TIMEOUT = "request_timeout"
+CONF_POLL_BUDGET = "poll_budget"
+CONF_RELAY_CONFIRM_INTERVAL = "relay_confirm_interval"
+CONF_RELAY_CONFIRM_ATTEMPTS = "relay_confirm_attempts"
+
+# Bounds of adaptive polling interval of each device, in seconds and minutes
+DEFAULT_SCAN_INTERVAL = 30
+DEFAULT_MAX_SCAN_INTERVAL = 10
+
+# Time budget of a poll in seconds
+DEFAULT_POLL_BUDGET = 25
+
+# Aggregation windows of level change sensors
+WINDOW_HOUR = "hour"
+WINDOW_DAY = "day"
+
+# Coordinators shared by config entries of the same account
+DATA_CLIENTS = "clients"
+
+# Storage of session tokens and device list between restarts
+STORAGE_VERSION = 1
+STORAGE_SAVE_DELAY = 10
+
+# Maximum number of devices polled in parallel
+DEFAULT_MAX_CONCURRENCY = 5
+
+# Polling of the device until it reports the new relay state
+RELAY_CONFIRM_INTERVAL = 1
+RELAY_CONFIRM_ATTEMPTS = 5
+
+SERVICE_SET_RELAYS = "set_relays"
+ATTR_TURN_ON = "turn_on"
+ATTR_TURN_OFF = "turn_off"
+# Sent with the requested state and RPC response when the service switched
+# a relay, formatted with device ID and relay
+SIGNAL_RELAY_SET = "estudna_relay_set_{}_{}"
@@ -0,0 +1,26 @@
+from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from . import get_device_id
+from .const import DOMAIN
+
+
+class EStudnaEntity(CoordinatorEntity):
+    """Base class of eSTUDNA entities."""
+
+    def __init__(self, coordinator, device: dict):
+        """Initialize the entity."""
+        super().__init__(coordinator)
+        self._device_id = get_device_id(device)
+        self._device_name = device.get("name")
+        self._attr_device_info = DeviceInfo(
+            identifiers={(DOMAIN, self._device_id)},
+            model=device.get("type"),
+            manufacturer="SEA Praha",
+            name=self._device_name,
+        )
+
+    @property
+    def device_id(self) -> str:
+        """Return device ID."""
+        return self._device_id
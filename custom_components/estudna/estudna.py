@@ -4,36 +4,375 @@
 a) Project foundation
 """
 
-import json
-from datetime import datetime
+import asyncio
+import bisect
+import contextlib
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import Counter
+from collections.abc import AsyncIterator, Callable, Iterable
 
 import aiohttp
 import jwt
 
+try:
+    # Faster parser, available in Home Assistant
+    from orjson import JSONDecodeError
+    from orjson import loads as json_loads
+except ImportError:
+    from json import JSONDecodeError
+    from json import loads as json_loads
+
+_LOGGER = logging.getLogger(__name__)
+
+# Telemetry keys read on every poll: water level and both relay outputs
+LEVEL_KEY = "ain1"
+TELEMETRY_KEYS = (LEVEL_KEY, "dout1", "dout2")
+# Telemetry keys holding state of the relays
+RELAY_KEYS = {"OUT1": "dout1", "OUT2": "dout2"}
+# Maximum number of relay commands sent in parallel
+RPC_CONCURRENCY = 5
+# Time span (ms) of one history request and maximum of raw values it returns
+HISTORY_CHUNK = 7 * 24 * 3600 * 1000
+HISTORY_LIMIT = 10000
+HOUR_MS = 3600 * 1000
+# Number of averaged buckets a range is split into to compute level change
+AGGREGATE_BUCKETS = 12
+# Number of devices fetched per page of the device list
+DEVICES_PAGE_SIZE = 100
+
+TIMESERIES_ENDPOINT = "/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
+WEBSOCKET_PATH = "/api/ws/plugins/telemetry"
+# Reconnect delays for the telemetry WebSocket, in seconds
+WEBSOCKET_BACKOFF_MIN = 1
+WEBSOCKET_BACKOFF_MAX = 300
+
+# Treat the token as expired this many seconds before its real expiry
+TOKEN_EXPIRY_MARGIN = 30
+# Refresh the token in the background this many seconds before the deadline
+TOKEN_REFRESH_AHEAD = 300
+
+# Default time limit (seconds) of a request, including its retries
+REQUEST_TIMEOUT = 30
+# Retries of idempotent requests on transient failures
+HTTP_RETRIES = 3
+HTTP_RETRY_BACKOFF = 1
+HTTP_RETRY_BACKOFF_MAX = 30
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Consecutive failures opening the circuit breaker and seconds it stays open
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_TIMEOUT = 60
+
+# Request rate limit per server, sustained requests per second and burst
+REQUEST_RATE = 10
+REQUEST_BURST = 20
+# Priority classes of requests, lower is sent first when rate limited
+PRIORITY_RPC = 0
+PRIORITY_AUTH = 1
+PRIORITY_REFRESH = 2
+PRIORITY_POLL = 3
+
+# Upper bounds (seconds) of request latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
 # ----------------------------------------------------------------------------
 # --- Code
 # ----------------------------------------------------------------------------
 
 
+def get_server(device_type: str) -> str:
+    """Return URL of the CML server used by device type."""
+    if device_type == "estudna2":
+        return "https://cml5.seapraha.cz"
+    return "https://cml.seapraha.cz"
+
+
+def get_device_id(device: dict) -> str:
+    """Extract device ID from device dict.
+
+    eSTUDNA2 has device["id"] as string, eSTUDNA has device["id"]["id"].
+    """
+    if isinstance(device["id"], dict):
+        return device["id"]["id"]
+    return device["id"]
+
+
+class CircuitOpenError(aiohttp.ClientError):
+    """Requests are not sent because the server keeps failing."""
+
+
+class CircuitBreaker:
+    """Stop sending requests to a server after repeated failures.
+
+    After the timeout, requests are allowed again and the first failure opens
+    the circuit once more.
+    """
+
+    def __init__(
+        self,
+        threshold: int = CIRCUIT_BREAKER_THRESHOLD,
+        timeout: float = CIRCUIT_BREAKER_TIMEOUT,
+    ):
+        self.threshold = threshold
+        self.timeout = timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return (
+            self.opened_at is not None
+            and time.monotonic() - self.opened_at < self.timeout
+        )
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if not self.is_open:
+                _LOGGER.debug("Opening circuit after %d failures", self.failures)
+            self.opened_at = time.monotonic()
+
+
+# Circuit breakers shared by all clients talking to the same server
+_CIRCUIT_BREAKERS: dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(server: str) -> CircuitBreaker:
+    """Return circuit breaker for a server."""
+    if server not in _CIRCUIT_BREAKERS:
+        _CIRCUIT_BREAKERS[server] = CircuitBreaker()
+    return _CIRCUIT_BREAKERS[server]
+
+
+class RequestScheduler:
+    """Token bucket rate limit of requests with priority ordering.
+
+    Requests exceeding the rate are deferred, waiting ones are released by
+    priority and then in order of arrival.
+    """
+
+    def __init__(self, rate: float = REQUEST_RATE, burst: int = REQUEST_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def queued(self) -> int:
+        """Return number of deferred requests."""
+        return sum(not future.done() for _, _, future in self._waiters)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = PRIORITY_POLL):
+        """Wait until a request of given priority can be sent."""
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Cancelled after being released, return the token
+                self._tokens += 1
+                self._schedule()
+            raise
+
+    def _schedule(self):
+        if self._timer is None and self._waiters:
+            self._timer = asyncio.get_running_loop().call_later(
+                max(0, (1 - self._tokens) / self.rate), self._release
+            )
+
+    def _release(self):
+        self._timer = None
+        self._refill()
+        while self._waiters and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            # Skip cancelled requests
+            if not future.done():
+                self._tokens -= 1
+                future.set_result(None)
+        self._schedule()
+
+
+# Request schedulers shared by all clients talking to the same server
+_SCHEDULERS: dict[str, RequestScheduler] = {}
+
+
+def get_request_scheduler(server: str) -> RequestScheduler:
+    """Return request scheduler for a server."""
+    if server not in _SCHEDULERS:
+        _SCHEDULERS[server] = RequestScheduler()
+    return _SCHEDULERS[server]
+
+
+class RequestDeadline:
+    """Deadline of a request, extended when a caller with a later one joins."""
+
+    __slots__ = ("_timeout", "sent", "when")
+
+    def __init__(self, when: float):
+        self.when = when
+        # Timeout of the attempt in progress
+        self._timeout: asyncio.Timeout | None = None
+        # Whether the attempt in progress reached the server
+        self.sent = False
+
+    def extend(self, when: float):
+        """Move the deadline later, including the attempt in progress."""
+        if when > self.when:
+            self.when = when
+            if self._timeout is not None:
+                self._timeout.reschedule(when)
+
+    @contextlib.asynccontextmanager
+    async def limit(self) -> AsyncIterator[None]:
+        """Limit an attempt of the request to the deadline."""
+        self.sent = False
+        async with asyncio.timeout_at(self.when) as self._timeout:
+            try:
+                yield
+            finally:
+                self._timeout = None
+
+
+class EndpointStats:
+    """Request count, latency histogram and status codes of an endpoint."""
+
+    __slots__ = ("errors", "latency_buckets", "latency_total", "requests", "statuses")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        # Last bucket counts requests slower than all LATENCY_BUCKETS
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.statuses: Counter[int | None] = Counter()
+
+    def record(self, latency: float, status: int | None):
+        """Record a request, status is None when no response was received."""
+        self.requests += 1
+        if status is None or status >= 400:
+            self.errors += 1
+        self.statuses[status] += 1
+        self.latency_total += latency
+        self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_mean": self.latency_total / self.requests
+            if self.requests
+            else None,
+            "latency_buckets": dict(
+                zip(
+                    [*map(str, LATENCY_BUCKETS), "inf"],
+                    self.latency_buckets,
+                    strict=True,
+                )
+            ),
+            "statuses": {
+                "error" if status is None else str(status): count
+                for status, count in self.statuses.items()
+            },
+        }
+
+
+class RequestStats:
+    """Statistics of requests made by a client."""
+
+    def __init__(self):
+        self.endpoints: dict[str, EndpointStats] = {}
+        self.logins = 0
+        self.token_refreshes = 0
+
+    @property
+    def requests(self) -> int:
+        """Return total number of requests."""
+        return sum(stats.requests for stats in self.endpoints.values())
+
+    def endpoint(self, name: str) -> EndpointStats:
+        """Return statistics of an endpoint."""
+        if name not in self.endpoints:
+            self.endpoints[name] = EndpointStats()
+        return self.endpoints[name]
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "logins": self.logins,
+            "token_refreshes": self.token_refreshes,
+            "endpoints": {
+                name: stats.as_dict() for name, stats in self.endpoints.items()
+            },
+        }
+
+
 class ThingsBoard:
     """CML ThinksBoard wrapper."""
 
     def __init__(
-        self, device_type: str = "estudna", session: aiohttp.ClientSession | None = None
+        self,
+        device_type: str = "estudna",
+        session: aiohttp.ClientSession | None = None,
+        token_margin: float = TOKEN_EXPIRY_MARGIN,
+        refresh_ahead: float = TOKEN_REFRESH_AHEAD,
+        retries: int = HTTP_RETRIES,
+        *,
+        timeout: float = REQUEST_TIMEOUT,
     ):
         """Initialize ThingsBoard with device type."""
         self.device_type = device_type
-        if device_type == "estudna2":
-            self.server = "https://cml5.seapraha.cz"
-        else:
-            self.server = "https://cml.seapraha.cz"
+        self.server = get_server(device_type)
         self.userToken = None
         self.refreshToken = None
         self.customerId = None
         self.user_id = None
+        self.token_margin = token_margin
+        self.refresh_ahead = refresh_ahead
+        self.retries = retries
+        self.timeout = timeout
+        # Monotonic time when the token should be considered expired
+        self._token_deadline = 0.0
+        self._refresh_timer: asyncio.TimerHandle | None = None
+        # Refresh in flight, shared by all callers
+        self._refresh_task: asyncio.Task | None = None
+        self._credentials: tuple[str, str] | None = None
+        # Called whenever the tokens change, for example to persist them
+        self.tokens_updated: Callable[[], None] | None = None
+        self.stats = RequestStats()
+        # Identical GET requests in flight with their deadline, shared by all
+        # callers of the same priority
+        self._pending: dict[tuple, tuple[asyncio.Task, RequestDeadline]] = {}
+        self._pending_callers: Counter[asyncio.Task] = Counter()
         self._session = session
         self._own_session = session is None
 
+    @property
+    def websocket_url(self) -> str:
+        """Return telemetry WebSocket URL."""
+        return self.server.replace("https://", "wss://", 1) + WEBSOCKET_PATH
+
     async def _get_session(self) -> aiohttp.ClientSession:
         """Get or create aiohttp session."""
         if self._session is None:
@@ -42,10 +381,42 @@ class ThingsBoard:
 
     async def close(self):
         """Close the aiohttp session if we own it."""
+        self._cancel_scheduled_refresh()
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._refresh_task
+            self._refresh_task = None
         if self._own_session and self._session is not None:
             await self._session.close()
             self._session = None
 
+    @property
+    def circuit_open(self) -> bool:
+        """Return whether requests to the server are currently suspended."""
+        return get_circuit_breaker(self.server).is_open
+
+    @property
+    def scheduler(self) -> RequestScheduler:
+        """Return request scheduler of the server."""
+        return get_request_scheduler(self.server)
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """Return delay before next retry, honoring Retry-After."""
+        if (
+            isinstance(error, aiohttp.ClientResponseError)
+            and error.status == 429
+            and error.headers
+        ):
+            with contextlib.suppress(TypeError, ValueError):
+                return min(
+                    float(error.headers.get("Retry-After")), HTTP_RETRY_BACKOFF_MAX
+                )
+        # Exponential backoff with full jitter
+        return random.uniform(
+            0, min(HTTP_RETRY_BACKOFF * 2**attempt, HTTP_RETRY_BACKOFF_MAX)
+        )
+
     async def http_request(
         self,
         method: str,
@@ -54,9 +425,162 @@ class ThingsBoard:
         params: dict[str, str] | None = None,
         data: dict[str, str] | None = None,
         check_token: bool = True,
+        *,
+        endpoint: str | None = None,
+        priority: int = PRIORITY_POLL,
+        timeout: float | None = None,
+    ):
+        """Send request to the server, retrying idempotent ones.
+
+        Statistics are collected per endpoint, which defaults to the URL and
+        should be a template for URLs including IDs. Requests are rate limited
+        per server, with priority deciding the order of deferred ones.
+        Identical GET requests of the same priority in flight are coalesced
+        into one, its deadline is extended to the latest one of the callers.
+        The timeout limits the request including waiting and retries, it
+        defaults to the timeout of the client.
+        """
+        if get_circuit_breaker(self.server).is_open:
+            raise CircuitOpenError(f"Circuit open for {self.server}")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.timeout if timeout is None else timeout)
+        request_deadline = RequestDeadline(deadline)
+        request = self._send_request(
+            method,
+            url,
+            header=header,
+            params=params,
+            data=data,
+            check_token=check_token,
+            endpoint=endpoint or url,
+            priority=priority,
+            deadline=request_deadline,
+        )
+        if method != "get":
+            return await request
+
+        key = (url, tuple(sorted((params or {}).items())), check_token, priority)
+        pending = self._pending.get(key)
+        # Do not join a request which is just timing out
+        if pending is None or pending[1].when <= loop.time():
+            task = asyncio.create_task(request)
+            self._pending[key] = (task, request_deadline)
+            task.add_done_callback(lambda task: self._request_done(key, task))
+        else:
+            task, request_deadline = pending
+            request_deadline.extend(deadline)
+            request.close()
+        self._pending_callers[task] += 1
+        try:
+            # The shared request might run longer for other callers
+            async with asyncio.timeout_at(deadline):
+                return await asyncio.shield(task)
+        finally:
+            self._pending_callers[task] -= 1
+            if not self._pending_callers[task]:
+                del self._pending_callers[task]
+                # Nobody is waiting for the response any more, unless it is
+                # timing out on its own and should be recorded as such
+                if not task.done() and request_deadline.when > loop.time():
+                    task.cancel()
+
+    def _request_done(self, key: tuple, task: asyncio.Task):
+        # It might have been replaced by a new request already
+        if self._pending.get(key, (None,))[0] is task:
+            del self._pending[key]
+        if not task.cancelled():
+            # Mark the exception retrieved, callers might have been cancelled
+            task.exception()
+
+    async def _send_request(
+        self,
+        method: str,
+        url: str,
+        *,
+        header: dict[str, str] | None,
+        params: dict[str, str] | None,
+        data: dict[str, str] | None,
+        check_token: bool,
+        endpoint: str,
+        priority: int,
+        deadline: RequestDeadline,
+    ):
+        breaker = get_circuit_breaker(self.server)
+        loop = asyncio.get_running_loop()
+
+        # Only idempotent requests are retried
+        retries = self.retries if method == "get" else 0
+        attempt = 0
+        while True:
+            try:
+                async with deadline.limit():
+                    result = await self._http_request(
+                        method,
+                        url,
+                        header=header,
+                        params=params,
+                        data=data,
+                        check_token=check_token,
+                        endpoint=endpoint,
+                        priority=priority,
+                        deadline=deadline,
+                    )
+            except aiohttp.ClientResponseError as err:
+                if err.status not in HTTP_RETRY_STATUSES:
+                    # The server is responding, the request itself is wrong
+                    breaker.record_success()
+                    raise
+                error = err
+            except TimeoutError as err:
+                if not deadline.sent:
+                    # Timed out waiting for the rate limit or a token, the
+                    # server has nothing to do with it
+                    raise
+                error = err
+            except aiohttp.ClientConnectionError as err:
+                error = err
+            else:
+                breaker.record_success()
+                return result
+
+            # Failed RPC calls mostly mean an offline device, only failing
+            # connections tell about the server
+            if method == "get" or (
+                isinstance(error, aiohttp.ClientConnectionError)
+                and not isinstance(error, TimeoutError)
+            ):
+                breaker.record_failure()
+            delay = self._retry_delay(attempt, error)
+            if (
+                attempt >= retries
+                or breaker.is_open
+                or loop.time() + delay >= deadline.when
+            ):
+                raise error
+            attempt += 1
+            _LOGGER.debug(
+                "Request to %s failed (%s), retry %d in %.1f s",
+                url,
+                error,
+                attempt,
+                delay,
+            )
+            await asyncio.sleep(delay)
+
+    async def _http_request(
+        self,
+        method: str,
+        url: str,
+        *,
+        header: dict[str, str] | None,
+        params: dict[str, str] | None,
+        data: dict[str, str] | None,
+        check_token: bool,
+        endpoint: str,
+        priority: int,
+        deadline: RequestDeadline,
     ):
-        if check_token and self.token_expired:
-            await self.refresh_token()
         if header is None:
             header = {}
 
@@ -68,28 +592,85 @@ class ThingsBoard:
         )
 
         session = await self._get_session()
-        async with session.request(
-            method, f"{self.server}{url}", headers=header, params=params, json=data
-        ) as response:
-            response.raise_for_status()
-            return await response.json()
+        stats = self.stats.endpoint(f"{method.upper()} {endpoint}")
+        for attempt in range(2):
+            deadline.sent = False
+            if check_token:
+                # Refresh also when the server rejected a token we considered valid
+                if attempt or self.token_expired:
+                    await self.refresh_token()
+                header["X-Authorization"] = f"Bearer {self.userToken}"
+
+            await self.scheduler.acquire(priority)
+            deadline.sent = True
+            start = time.monotonic()
+            status = None
+            try:
+                async with session.request(
+                    method,
+                    f"{self.server}{url}",
+                    headers=header,
+                    params=params,
+                    json=data,
+                ) as response:
+                    status = response.status
+                    if check_token and not attempt and status == 401:
+                        _LOGGER.debug("Token rejected by server, refreshing")
+                        continue
+                    response.raise_for_status()
+                    # Decode the raw body at once, without text decoding
+                    body = await response.read()
+                    return json_loads(body) if body.strip() else None
+            finally:
+                stats.record(time.monotonic() - start, status)
+        return None
 
-    async def http_post(self, url: str, data: dict[str, str], check_token: bool = True):
-        return await self.http_request("post", url, data=data, check_token=check_token)
+    async def http_post(
+        self,
+        url: str,
+        data: dict[str, str],
+        check_token: bool = True,
+        *,
+        endpoint: str | None = None,
+        priority: int = PRIORITY_POLL,
+        timeout: float | None = None,
+    ):
+        return await self.http_request(
+            "post",
+            url,
+            data=data,
+            check_token=check_token,
+            endpoint=endpoint,
+            priority=priority,
+            timeout=timeout,
+        )
 
     async def http_get(
         self,
         url: str,
         params: dict[str, str] | None = None,
         check_token: bool = True,
+        *,
+        endpoint: str | None = None,
+        priority: int = PRIORITY_POLL,
+        timeout: float | None = None,
     ):
-        header = {"X-Authorization": f"Bearer {self.userToken}"}
         return await self.http_request(
-            "get", url, header=header, params=params, check_token=check_token
+            "get",
+            url,
+            params=params,
+            check_token=check_token,
+            endpoint=endpoint,
+            priority=priority,
+            timeout=timeout,
         )
 
     async def login(self, username: str, password: str):
         """Login."""
+        # Keep credentials to login again when the refresh token is rejected
+        self._credentials = (username, password)
+        self.stats.logins += 1
+
         # Get access and refresh tokens
         if self.device_type == "estudna2":
             url = "/apiv2/auth/login"
@@ -97,10 +678,12 @@ class ThingsBoard:
             url = "/api/auth/login"
 
         response = await self.http_post(
-            url, data={"username": username, "password": password}, check_token=False
+            url,
+            data={"username": username, "password": password},
+            check_token=False,
+            priority=PRIORITY_AUTH,
         )
-        self.userToken = response["token"]
-        self.refreshToken = response["refreshToken"]
+        self._store_tokens(response)
 
         # Get customer ID or user ID depending on device type
         if self.device_type == "estudna2":
@@ -108,29 +691,113 @@ class ThingsBoard:
             if not self.user_id:
                 raise ValueError("Login failed: missing user_id")
         else:
+            # Use the new token as is, refreshing it on rejection would wait
+            # for itself when logging in again from a token refresh
             url = "/api/auth/user"
-            response = await self.http_get(url)
+            response = await self.http_request(
+                "get",
+                url,
+                header={"X-Authorization": f"Bearer {self.userToken}"},
+                check_token=False,
+                priority=PRIORITY_AUTH,
+            )
             self.customerId = response["customerId"]["id"]
 
     async def refresh_token(self):
-        """Refresh JWT token."""
+        """Refresh JWT token.
+
+        Concurrent callers share a single refresh request.
+        """
+        await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_tokens())
+            self._refresh_task.add_done_callback(self._refresh_done)
+        return self._refresh_task
+
+    def _refresh_done(self, task: asyncio.Task):
+        self._refresh_task = None
+        if not task.cancelled() and (err := task.exception()):
+            _LOGGER.debug("Token refresh failed: %s", err)
+
+    async def _refresh_tokens(self):
         if self.device_type == "estudna2":
             url = "/apiv2/auth/token"
         else:
             url = "/api/auth/token"
 
-        response = await self.http_post(
-            url, data={"refreshToken": self.refreshToken}, check_token=False
+        self.stats.token_refreshes += 1
+        try:
+            response = await self.http_post(
+                url,
+                data={"refreshToken": self.refreshToken},
+                check_token=False,
+                priority=PRIORITY_AUTH,
+            )
+        except aiohttp.ClientResponseError as err:
+            if err.status not in {401, 403} or self._credentials is None:
+                raise
+            _LOGGER.debug("Refresh token rejected, logging in again")
+            await self.login(*self._credentials)
+        else:
+            self._store_tokens(response)
+
+    def export_session(self) -> dict:
+        """Return session data which can be later passed to restore_session."""
+        return {
+            "token": self.userToken,
+            "refresh_token": self.refreshToken,
+            "customer_id": self.customerId,
+            "user_id": self.user_id,
+        }
+
+    def restore_session(self, username: str, password: str, session: dict):
+        """Restore session saved by export_session instead of logging in.
+
+        Expired or rejected tokens are refreshed, or the client logs in again.
+        """
+        self._credentials = (username, password)
+        self.customerId = session["customer_id"]
+        self.user_id = session["user_id"]
+        self._store_tokens(
+            {"token": session["token"], "refreshToken": session["refresh_token"]}
         )
+
+    def _store_tokens(self, response: dict):
+        """Store tokens from auth response and schedule their refresh."""
         self.userToken = response["token"]
         self.refreshToken = response["refreshToken"]
 
+        # Decode the expiry only once, and track it on the monotonic clock
+        this_jwt = jwt.decode(self.userToken, options={"verify_signature": False})
+        remaining = this_jwt["exp"] - time.time() - self.token_margin
+        self._token_deadline = time.monotonic() + remaining
+
+        if self.tokens_updated is not None:
+            self.tokens_updated()
+
+        self._cancel_scheduled_refresh()
+        delay = remaining - self.refresh_ahead
+        if delay > 0:
+            self._refresh_timer = asyncio.get_running_loop().call_later(
+                delay, self._start_background_refresh
+            )
+
+    def _cancel_scheduled_refresh(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+
+    def _start_background_refresh(self):
+        self._refresh_timer = None
+        # Failures are logged, the next request will retry the refresh
+        self._start_refresh()
+
     @property
     def token_expired(self):
         """Check JWT token expiry."""
-        this_jwt = jwt.decode(self.userToken, options={"verify_signature": False})
-        expiry_time = datetime.fromtimestamp(this_jwt["exp"])
-        return expiry_time <= datetime.now()
+        return time.monotonic() >= self._token_deadline
 
     async def get_devices(self):
         """List devices."""
@@ -138,91 +805,396 @@ class ThingsBoard:
             if not self.user_id:
                 raise ValueError("No user_id. Please login first.")
             url = f"/apiv2/user/{self.user_id}/devices"
-            response = await self.http_get(url)
+            response = await self.http_get(
+                url, endpoint="/apiv2/user/{user_id}/devices"
+            )
             devices = (
                 response if isinstance(response, list) else response.get("data", [])
             )
         else:
             url = f"/api/customer/{self.customerId}/devices"
-            params = {"pageSize": 100, "page": 0}
-            response = await self.http_get(url, params=params)
-            devices = response.get("data", [])
+            devices = []
+            page = 0
+            while True:
+                params = {"pageSize": DEVICES_PAGE_SIZE, "page": page}
+                response = await self.http_get(
+                    url, params=params, endpoint="/api/customer/{customer_id}/devices"
+                )
+                devices.extend(response.get("data", []))
+                if not response.get("hasNext"):
+                    break
+                page += 1
 
         if not devices:
             raise Exception("No device has not been found!")  # noqa: TRY002
 
         return devices
 
-    async def get_device_values(self, device_id: str, keys: str):
+    async def get_device_values(
+        self,
+        device_id: str,
+        keys: str,
+        priority: int = PRIORITY_POLL,
+        timeout: float | None = None,
+    ):
         """Get current values."""
         if self.device_type == "estudna2":
             url = f"/apiv2/device/{device_id}/latest"
-            return await self.http_get(url)
+            return await self.http_get(
+                url,
+                endpoint="/apiv2/device/{device_id}/latest",
+                priority=priority,
+                timeout=timeout,
+            )
         url = f"/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
         params = {"keys": keys}
-        return await self.http_get(url, params=params)
+        return await self.http_get(
+            url,
+            params=params,
+            endpoint=TIMESERIES_ENDPOINT,
+            priority=priority,
+            timeout=timeout,
+        )
 
-    async def get_estudna_level(self, device_id: str):
-        values = await self.get_device_values(device_id, "ain1")
+    async def get_device_snapshot(
+        self,
+        device_id: str,
+        keys: tuple[str, ...] = TELEMETRY_KEYS,
+        priority: int = PRIORITY_POLL,
+        timeout: float | None = None,
+    ):
+        """Get current values for all keys with a single request.
+
+        The result can be passed to decode_values.
+        """
+        return await self.get_device_values(
+            device_id, ",".join(keys), priority, timeout
+        )
 
+    def decode_values(
+        self, values: dict, keys: Iterable[str] = TELEMETRY_KEYS
+    ) -> dict[str, tuple[float | bool | None, int | None]]:
+        """Decode latest telemetry of keys in a single pass.
+
+        Returns (value, ts) for every key present in values, timestamps are
+        in milliseconds. The level is a float, None when it can not be
+        parsed, relay states are bools. eSTUDNA2 values are JSON objects
+        encoded in a string, which are unwrapped here.
+        """
+        nested = self.device_type == "estudna2"
+        result = {}
+        for key in keys:
+            try:
+                entry = values[key][0]
+            except (KeyError, IndexError, TypeError):
+                continue
+            value = entry.get("value")
+            if nested and isinstance(value, str) and value.startswith("{"):
+                try:
+                    value = json_loads(value)
+                except JSONDecodeError:
+                    value = None
+            if isinstance(value, dict):
+                value = value.get("str")
+
+            if key == LEVEL_KEY:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = None
+            else:
+                # Relay states are "1" (on) or "0" (off)
+                value = str(value).lower() in {"1", "true"}
+            result[key] = (value, entry.get("ts"))
+        return result
+
+    def parse_estudna_level(self, values: dict) -> float | None:
+        """Extract water level from device values."""
+        return self.decode_values(values, (LEVEL_KEY,)).get(LEVEL_KEY, (None,))[0]
+
+    def parse_relay_state(self, values: dict, relay: str) -> bool:
+        """Extract relay state (OUT1 or OUT2) from device values."""
+        key = RELAY_KEYS[relay]
+        return self.decode_values(values, (key,)).get(key, (False,))[0]
+
+    def parse_timestamp(self, values: dict, key: str) -> int | None:
+        """Extract telemetry timestamp of a key in milliseconds."""
+        return self.decode_values(values, (key,)).get(key, (None, None))[1]
+
+    async def iter_level_history(
+        self,
+        device_id: str,
+        start_ts: int,
+        end_ts: int,
+        *,
+        agg: str = "NONE",
+        interval: int | None = None,
+        chunk: int = HISTORY_CHUNK,
+    ) -> AsyncIterator[list[tuple[int, float]]]:
+        """Yield water level history as (ts, value) lists, oldest first.
+
+        Timestamps are in milliseconds. The range is fetched in chunks, raw
+        values are paginated when a chunk holds more than HISTORY_LIMIT.
+        """
         if self.device_type == "estudna2":
-            # eSTUDNA2 uses a different format with JSON-encoded values
-            if not values or "ain1" not in values:
-                return None
+            raise ValueError("History is not available for eSTUDNA2")
 
-            raw = values["ain1"]
-            if isinstance(raw, list) and raw:
-                val_str = raw[0].get("value")
+        url = f"/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
+        chunk_start = start_ts
+        while chunk_start < end_ts:
+            chunk_end = min(chunk_start + chunk, end_ts)
+            params = {
+                "keys": "ain1",
+                "startTs": str(chunk_start),
+                "endTs": str(chunk_end),
+                "limit": str(HISTORY_LIMIT),
+                "agg": agg,
+                "orderBy": "ASC",
+            }
+            if interval is not None:
+                params["interval"] = str(interval)
+            response = await self.http_get(
+                url, params=params, endpoint=TIMESERIES_ENDPOINT
+            )
+            raw = response.get("ain1", [])
+            if agg == "NONE" and len(raw) == HISTORY_LIMIT:
+                # Continue after the last value within the same chunk
+                chunk_start = raw[-1]["ts"] + 1
+            else:
+                chunk_start = chunk_end
+
+            entries = []
+            for entry in raw:
                 try:
-                    val_json = json.loads(val_str)
-                    return float(val_json.get("str"))
-                except (ValueError, TypeError, json.JSONDecodeError):
-                    return None
+                    entries.append((entry["ts"], float(entry["value"])))
+                except (KeyError, TypeError, ValueError):
+                    continue
+            if entries:
+                yield entries
+
+    async def iter_hourly_level(
+        self, device_id: str, start_ts: int, end_ts: int, chunk: int = HISTORY_CHUNK
+    ) -> AsyncIterator[list[tuple[int, float, float, float]]]:
+        """Yield hourly (start, mean, min, max) water level lists, oldest first.
+
+        start_ts should be aligned to an hour. Aggregation is done by the
+        server, three requests are made per chunk.
+        """
+        chunk_start = start_ts
+        while chunk_start < end_ts:
+            chunk_end = min(chunk_start + chunk, end_ts)
+            hours: dict[int, dict[str, float]] = {}
+            for agg in ("AVG", "MIN", "MAX"):
+                async for entries in self.iter_level_history(
+                    device_id,
+                    chunk_start,
+                    chunk_end,
+                    agg=agg,
+                    interval=HOUR_MS,
+                    chunk=chunk,
+                ):
+                    for ts, value in entries:
+                        # Aggregated values are timestamped within the interval
+                        hour = ts - (ts - start_ts) % HOUR_MS
+                        hours.setdefault(hour, {})[agg] = value
+            yield [
+                (hour, values["AVG"], values["MIN"], values["MAX"])
+                for hour, values in sorted(hours.items())
+                if len(values) == 3
+            ]
+            chunk_start = chunk_end
+
+    async def get_level_change(
+        self, device_id: str, start_ts: int, end_ts: int
+    ) -> tuple[float, float] | None:
+        """Return level change (m) and rate (m/h) over a time range.
+
+        The range is split into AGGREGATE_BUCKETS averaged by the server,
+        the change is the difference between the first and the last average.
+        Returns None when there is not enough data.
+        """
+        values = []
+        async for entries in self.iter_level_history(
+            device_id,
+            start_ts,
+            end_ts,
+            agg="AVG",
+            interval=(end_ts - start_ts) // AGGREGATE_BUCKETS,
+            chunk=end_ts - start_ts,
+        ):
+            values.extend(entries)
+        if len(values) < 2:
             return None
-        # Original eSTUDNA format
-        return values["ain1"][0]["value"]
+        (first_ts, first), (last_ts, last) = values[0], values[-1]
+        change = last - first
+        return change, change / ((last_ts - first_ts) / HOUR_MS)
+
+    async def get_estudna_level(self, device_id: str):
+        values = await self.get_device_values(device_id, "ain1")
+        return self.parse_estudna_level(values)
 
     async def get_relay_state(self, device_id: str, relay: str):
         """Get relay state (OUT1 or OUT2)."""
-        # State keys are lowercase: dout1, dout2
-        state_key = "dout1" if relay == "OUT1" else "dout2"
-        values = await self.get_device_values(device_id, state_key)
+        values = await self.get_device_values(device_id, RELAY_KEYS[relay])
+        return self.parse_relay_state(values, relay)
 
-        if self.device_type == "estudna2":
-            # eSTUDNA2 API returns telemetry data differently
-            if (
-                state_key in values
-                and isinstance(values[state_key], list)
-                and values[state_key]
-            ):
-                value_entry = values[state_key][0].get("value")
-                if value_entry:
-                    # Parse JSON-encoded value if needed
-                    try:
-                        val_json = json.loads(value_entry)
-                        return val_json.get("str") in {"1", "true"}
-                    except (ValueError, TypeError, json.JSONDecodeError):
-                        # Fallback to direct string comparison
-                        return value_entry in {"1", "true"}
-            return False
-
-        # Original eSTUDNA format
-        if state_key in values and len(values[state_key]) > 0:
-            # Values are string "1" (on) or "0" (off)
-            return values[state_key][0]["value"] == "1"
-        return False
+    async def set_relay_states(
+        self,
+        commands: list[tuple[str, str, bool]],
+        max_concurrency: int = RPC_CONCURRENCY,
+    ) -> list:
+        """Set state of several relays in parallel.
+
+        Commands are (device_id, relay, state) tuples. Returns RPC response
+        or raised exception for each command.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def send(device_id: str, relay: str, state: bool):
+            async with semaphore:
+                return await self.set_relay_state(device_id, relay, state)
+
+        return await asyncio.gather(
+            *(send(*command) for command in commands), return_exceptions=True
+        )
+
+    def parse_rpc_state(self, response) -> bool | None:
+        """Extract relay state from RPC response, None if it does not include it."""
+        if isinstance(response, dict):
+            response = response.get("params", response.get("value"))
+        if isinstance(response, bool):
+            return response
+        return {"1": True, "true": True, "0": False, "false": False}.get(
+            str(response).lower()
+        )
 
     async def set_relay_state(self, device_id: str, relay: str, state: bool):
         """Set relay state (OUT1 or OUT2)."""
         method = "setDout1" if relay == "OUT1" else "setDout2"
         data = {"method": method, "params": state}
-        header = {"X-Authorization": f"Bearer {self.userToken}"}
 
         if self.device_type == "estudna2":
             # eSTUDNA2 uses /device/{id}/rpc/twoway endpoint
-            url = f"/apiv2/device/{device_id}/rpc/twoway"
+            endpoint = "/apiv2/device/{device_id}/rpc/twoway"
         else:
             # Original eSTUDNA uses /api/rpc/twoway/{id} endpoint
-            url = f"/api/rpc/twoway/{device_id}"
+            endpoint = "/api/rpc/twoway/{device_id}"
+
+        return await self.http_request(
+            "post",
+            endpoint.format(device_id=device_id),
+            data=data,
+            endpoint=endpoint,
+            priority=PRIORITY_RPC,
+        )
+
 
-        return await self.http_request("post", url, header=header, data=data)
+class TelemetrySubscription:
+    """Live telemetry updates over the ThingsBoard WebSocket API.
+
+    Subscribes to the latest telemetry of given devices and passes every
+    update to the callback in the same shape as get_device_values returns.
+    """
+
+    def __init__(
+        self,
+        thingsboard: ThingsBoard,
+        device_ids: list[str],
+        callback: Callable[[str, dict], None],
+        keys: tuple[str, ...] = TELEMETRY_KEYS,
+    ):
+        self.thingsboard = thingsboard
+        self.device_ids = device_ids
+        self.callback = callback
+        self.keys = keys
+        self._task: asyncio.Task | None = None
+        self._connected = False
+
+    def start(self):
+        """Start the subscription in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the subscription."""
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self):
+        """Keep the WebSocket connected, reconnecting with backoff."""
+        delay = WEBSOCKET_BACKOFF_MIN
+        warned = False
+        while True:
+            unexpected = False
+            try:
+                await self._listen()
+            except (TimeoutError, aiohttp.ClientError, ValueError) as err:
+                _LOGGER.debug("Telemetry WebSocket failed: %s", err)
+            except Exception:
+                # Keep the subscription running, polling is only a safety net
+                unexpected = True
+                _LOGGER.log(
+                    logging.DEBUG if warned else logging.WARNING,
+                    "Unexpected error in telemetry WebSocket",
+                    exc_info=True,
+                )
+                warned = True
+            connected, self._connected = self._connected, False
+            if connected and not unexpected:
+                # Start over with short delay after a working connection
+                delay = WEBSOCKET_BACKOFF_MIN
+                warned = False
+            _LOGGER.debug("Reconnecting telemetry WebSocket in %d s", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WEBSOCKET_BACKOFF_MAX)
+
+    async def _listen(self):
+        """Subscribe to telemetry and process updates until disconnected."""
+        if self.thingsboard.token_expired:
+            await self.thingsboard.refresh_token()
+
+        session = await self.thingsboard._get_session()  # noqa: SLF001
+        async with session.ws_connect(
+            self.thingsboard.websocket_url,
+            params={"token": self.thingsboard.userToken},
+            heartbeat=30,
+        ) as websocket:
+            self._connected = True
+            subscriptions = dict(enumerate(self.device_ids, start=1))
+            await websocket.send_json(
+                {
+                    "tsSubCmds": [
+                        {
+                            "entityType": "DEVICE",
+                            "entityId": device_id,
+                            "scope": "LATEST_TELEMETRY",
+                            "cmdId": cmd_id,
+                            "keys": ",".join(self.keys),
+                        }
+                        for cmd_id, device_id in subscriptions.items()
+                    ],
+                    "historyCmds": [],
+                    "attrSubCmds": [],
+                }
+            )
+            async for message in websocket:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                payload = json_loads(message.data)
+                if payload.get("errorCode"):
+                    _LOGGER.debug(
+                        "Telemetry subscription error: %s", payload.get("errorMsg")
+                    )
+                    continue
+                device_id = subscriptions.get(payload.get("subscriptionId"))
+                if device_id is None or not payload.get("data"):
+                    continue
+                # Convert [[ts, value], ...] pairs to the REST response format
+                values = {
+                    key: [{"ts": ts, "value": value} for ts, value in entries]
+                    for key, entries in payload["data"].items()
+                }
+                self.callback(device_id, values)
@@ -0,0 +1,96 @@
+"""Import of water level history into long-term statistics."""
+
+import logging
+from datetime import timedelta
+
+from homeassistant.components.recorder import get_instance
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
+from homeassistant.components.recorder.statistics import (
+    async_add_external_statistics,
+    get_last_statistics,
+)
+from homeassistant.const import UnitOfLength
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from homeassistant.util import slugify
+
+from .const import DEVICE_TYPE_ESTUDNA2, DOMAIN
+from .estudna import ThingsBoard
+
+_LOGGER = logging.getLogger(__name__)
+
+# How far back history is imported when there are no statistics yet
+BACKFILL_MAX_AGE = timedelta(days=30)
+
+
+def get_statistic_id(device_id: str) -> str:
+    """Return external statistic ID for the level of a device."""
+    return f"{DOMAIN}:level_{slugify(device_id)}"
+
+
+async def async_import_level_statistics(
+    hass: HomeAssistant,
+    thingsboard: ThingsBoard,
+    devices: dict[str, str],
+    checked: dict[str, float],
+) -> None:
+    """Import hourly level statistics of devices, given as ID to name mapping.
+
+    Continues after the last imported hour, so gaps caused by downtime are
+    filled in with a few bulk requests. The end of the last checked range is
+    kept in checked as UNIX timestamp per device, so ranges without any data
+    are not requested again.
+    """
+    if thingsboard.device_type == DEVICE_TYPE_ESTUDNA2:
+        return
+
+    for device_id in checked.keys() - devices.keys():
+        del checked[device_id]
+
+    # Only import complete hours
+    end = dt_util.utcnow().replace(minute=0, second=0, microsecond=0)
+    for device_id, name in devices.items():
+        statistic_id = get_statistic_id(device_id)
+        last = await get_instance(hass).async_add_executor_job(
+            get_last_statistics, hass, 1, statistic_id, True, {"start"}
+        )
+        if last.get(statistic_id):
+            start = dt_util.utc_from_timestamp(
+                last[statistic_id][0]["start"]
+            ) + timedelta(hours=1)
+        else:
+            start = end - BACKFILL_MAX_AGE
+        if device_id in checked:
+            start = max(start, dt_util.utc_from_timestamp(checked[device_id]))
+        if start >= end:
+            continue
+
+        _LOGGER.debug("Importing level history of %s since %s", device_id, start)
+        metadata = StatisticMetaData(
+            has_mean=True,
+            has_sum=False,
+            name=f"{name} level",
+            source=DOMAIN,
+            statistic_id=statistic_id,
+            unit_of_measurement=UnitOfLength.METERS,
+        )
+        async for hours in thingsboard.iter_hourly_level(
+            device_id,
+            int(start.timestamp() * 1000),
+            int(end.timestamp() * 1000),
+        ):
+            if hours:
+                async_add_external_statistics(
+                    hass,
+                    metadata,
+                    [
+                        StatisticData(
+                            start=dt_util.utc_from_timestamp(ts / 1000),
+                            mean=mean,
+                            min=minimum,
+                            max=maximum,
+                        )
+                        for ts, mean, minimum, maximum in hours
+                    ],
+                )
+        checked[device_id] = end.timestamp()
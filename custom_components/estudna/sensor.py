@@ -1,64 +1,191 @@
 import logging
+import time
 
-from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorStateClass,
+)
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import UnitOfLength
-from homeassistant.core import HomeAssistant
-from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.const import EntityCategory, UnitOfLength, UnitOfTime
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.device_registry import DeviceEntryType, DeviceInfo
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.util import dt as dt_util
 
-from . import get_device_id
-from .const import DOMAIN
+from .const import ATTR_LAST_READING, DOMAIN, WINDOW_DAY, WINDOW_HOUR
+from .entity import EStudnaEntity
 
 _LOGGER = logging.getLogger(__name__)
 
+WINDOW_NAMES = {WINDOW_HOUR: "last hour", WINDOW_DAY: "last day"}
 
-class EStudnaSensor(CoordinatorEntity, SensorEntity):
+# Coordinator attribute of diagnostic sensors, with their name, device class
+# and unit
+DIAGNOSTIC_SENSORS = {
+    "last_poll_duration": (
+        "last poll duration",
+        SensorDeviceClass.DURATION,
+        UnitOfTime.SECONDS,
+    ),
+    "last_poll_requests": ("requests per poll", None, None),
+    "last_poll_success": ("last successful poll", SensorDeviceClass.TIMESTAMP, None),
+}
+
+
+class EStudnaSensor(EStudnaEntity, SensorEntity):
     """Representation of an eSTUDNA sensor."""
 
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_native_unit_of_measurement = UnitOfLength.METERS
+
     def __init__(self, coordinator, device: dict):
         """Initialize the sensor."""
-        super().__init__(coordinator)
-        self._device = device
-        self._device_id = get_device_id(device)
-        self._attr_state_class = SensorStateClass.MEASUREMENT
-        self._attr_native_unit_of_measurement = UnitOfLength.METERS
+        super().__init__(coordinator, device)
+        self._state = coordinator.states[self._device_id]
+        self._attr_name = self._device_name
         self._attr_unique_id = self._device_id
+        self._last_available: bool | None = None
+        # Level shown in the state and monotonic time it was written
+        self._level = self._state.level
+        self._written_at = time.monotonic()
+
+    @property
+    def native_value(self):
+        """Return the state of the sensor."""
+        return self._level
 
     @property
-    def device_id(self) -> str:
-        """Return device ID."""
-        return self._device_id
+    def extra_state_attributes(self):
+        """Return time of the last reading."""
+        timestamp = self._state.level_ts
+        if timestamp is None:
+            return None
+        return {ATTR_LAST_READING: dt_util.utc_from_timestamp(timestamp / 1000)}
 
     @property
-    def device_info(self) -> DeviceInfo:
-        """Return device info."""
-        return DeviceInfo(
-            identifiers={(DOMAIN, self._device_id)},
-            model=self._device.get("type"),
-            manufacturer="SEA Praha",
-            name=self._device.get("name"),
+    def available(self):
+        """Return if entity is available."""
+        return self.coordinator.last_update_success and self._level is not None
+
+    def _is_significant(self, level: float | None) -> bool:
+        """Return whether level differs from the shown one beyond the deadband."""
+        if level is None or self._level is None:
+            return level != self._level
+        deadband = max(
+            self.coordinator.level_deadband,
+            abs(self._level) * self.coordinator.level_deadband_percent / 100,
         )
+        if not deadband:
+            return level != self._level
+        return abs(level - self._level) >= deadband
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Write state only on significant change or after the heartbeat.
+
+        Changes within the deadband are held back until the heartbeat
+        interval since the last write passes.
+        """
+        level = self._state.level
+        now = time.monotonic()
+        if (
+            self._is_significant(level)
+            or (
+                level != self._level
+                and now - self._written_at >= self.coordinator.level_heartbeat
+            )
+            or self.coordinator.last_update_success != self._last_available
+        ):
+            self._level = level
+            self._written_at = now
+            self._last_available = self.coordinator.last_update_success
+            super()._handle_coordinator_update()
+
+
+class EStudnaLevelChangeSensor(EStudnaEntity, SensorEntity):
+    """Level change of an eSTUDNA device over past hour or day."""
+
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_native_unit_of_measurement = UnitOfLength.METERS
+
+    def __init__(self, coordinator, device: dict, window: str):
+        """Initialize the sensor."""
+        super().__init__(coordinator, device)
+        self._window = window
+        self._attr_name = f"{self._device_name} level change {WINDOW_NAMES[window]}"
+        self._attr_unique_id = f"{self._device_id}_level_change_{window}"
 
     @property
-    def name(self):
-        """Return the name of the sensor."""
-        return self._device.get("name")
+    def _result(self) -> tuple[float, float] | None:
+        """Return level change and rate for the window."""
+        if self.coordinator.data is None:
+            return None
+        return self.coordinator.data.get(self._device_id, {}).get(self._window)
 
     @property
     def native_value(self):
         """Return the state of the sensor."""
-        return self.coordinator.data.get(f"{self._device_id}_level")
+        result = self._result
+        return None if result is None else round(result[0], 3)
 
     @property
     def available(self):
         """Return if entity is available."""
-        return (
-            self.coordinator.last_update_success
-            and self.coordinator.data.get(f"{self._device_id}_level") is not None
+        return self.coordinator.last_update_success and self._result is not None
+
+
+class EStudnaLevelRateSensor(EStudnaLevelChangeSensor):
+    """Fill (positive) or drain (negative) rate of an eSTUDNA device."""
+
+    _attr_native_unit_of_measurement = "m/h"
+
+    def __init__(self, coordinator, device: dict):
+        """Initialize the sensor."""
+        super().__init__(coordinator, device, WINDOW_HOUR)
+        self._attr_name = f"{self._device_name} level rate"
+        self._attr_unique_id = f"{self._device_id}_level_rate"
+
+    @property
+    def native_value(self):
+        """Return the state of the sensor."""
+        result = self._result
+        return None if result is None else round(result[1], 3)
+
+
+class EStudnaDiagnosticSensor(CoordinatorEntity, SensorEntity):
+    """Polling statistics of an eSTUDNA account."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+
+    def __init__(self, coordinator, config_entry: ConfigEntry, key: str):
+        """Initialize the sensor."""
+        super().__init__(coordinator)
+        self._key = key
+        name, device_class, unit = DIAGNOSTIC_SENSORS[key]
+        self._attr_name = f"{config_entry.title} {name}"
+        self._attr_unique_id = f"{config_entry.entry_id}_{key}"
+        self._attr_device_class = device_class
+        self._attr_native_unit_of_measurement = unit
+        if device_class != SensorDeviceClass.TIMESTAMP:
+            self._attr_state_class = SensorStateClass.MEASUREMENT
+        self._attr_device_info = DeviceInfo(
+            identifiers={(DOMAIN, config_entry.entry_id)},
+            manufacturer="SEA Praha",
+            name=config_entry.title,
+            entry_type=DeviceEntryType.SERVICE,
         )
 
+    @property
+    def native_value(self):
+        """Return the state of the sensor."""
+        value = getattr(self.coordinator, self._key)
+        if isinstance(value, float):
+            return round(value, 3)
+        return value
+
 
 async def async_setup_entry(
     hass: HomeAssistant,
@@ -68,6 +195,21 @@ async def async_setup_entry(
     """Set up eSTUDNA sensors from config entry."""
     coordinator = hass.data[DOMAIN][config_entry.entry_id]
 
-    entities = [EStudnaSensor(coordinator, device) for device in coordinator.devices]
+    @callback
+    def add_devices(devices: list[dict]):
+        entities = [EStudnaSensor(coordinator, device) for device in devices]
+        if (aggregates := coordinator.aggregates) is not None:
+            for device in devices:
+                entities.extend(
+                    EStudnaLevelChangeSensor(aggregates, device, window)
+                    for window in WINDOW_NAMES
+                )
+                entities.append(EStudnaLevelRateSensor(aggregates, device))
+        async_add_entities(entities)
 
-    async_add_entities(entities)
+    add_devices(coordinator.devices)
+    async_add_entities(
+        EStudnaDiagnosticSensor(coordinator, config_entry, key)
+        for key in DIAGNOSTIC_SENSORS
+    )
+    config_entry.async_on_unload(coordinator.async_add_device_listener(add_devices))
@@ -0,0 +1,152 @@
+"""Services for the estudna integration."""
+
+import asyncio
+import logging
+
+import voluptuous as vol
+from homeassistant.const import ATTR_ENTITY_ID
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+)
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+
+from .const import (
+    ATTR_TURN_OFF,
+    ATTR_TURN_ON,
+    DOMAIN,
+    SERVICE_SET_RELAYS,
+    SIGNAL_RELAY_SET,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+SET_RELAYS_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_TURN_ON, default=[]): cv.entity_ids,
+        vol.Optional(ATTR_TURN_OFF, default=[]): cv.entity_ids,
+    }
+)
+
+
+async def async_confirm_relays(coordinator, commands: list[tuple[str, str, bool]]):
+    """Refresh devices until they report the new relay states.
+
+    Commands are (device_id, relay, state) tuples, all pending devices are
+    refreshed together on every attempt.
+    """
+    for _attempt in range(coordinator.relay_confirm_attempts):
+        await asyncio.sleep(coordinator.relay_confirm_interval)
+        device_ids = list(
+            dict.fromkeys(
+                device_id
+                for device_id, relay, state in commands
+                if (device_state := coordinator.states.get(device_id)) is not None
+                and device_state.relays.get(relay) != state
+            )
+        )
+        if not device_ids:
+            return
+        await coordinator.async_refresh_selected(device_ids)
+
+
+async def async_set_relays(call: ServiceCall) -> ServiceResponse:
+    """Switch several relays at once.
+
+    Commands are sent in parallel, also across accounts. Switched relays show
+    the requested state right away, like when switched one by one, while the
+    affected devices of each account are refreshed together in the background.
+    """
+    hass = call.hass
+    registry = er.async_get(hass)
+
+    # Group commands by coordinator, entries of the same account share it
+    commands: dict[DataUpdateCoordinator, list[tuple[str, str, str, bool]]] = {}
+    for state, entity_ids in (
+        (True, call.data[ATTR_TURN_ON]),
+        (False, call.data[ATTR_TURN_OFF]),
+    ):
+        for entity_id in entity_ids:
+            entry = registry.async_get(entity_id)
+            if (
+                entry is None
+                or entry.platform != DOMAIN
+                or entry.domain != "switch"
+                or entry.config_entry_id not in hass.data.get(DOMAIN, {})
+            ):
+                raise HomeAssistantError(f"{entity_id} is not an eSTUDNA relay")
+            device_id, relay = entry.unique_id.rsplit("_", 1)
+            commands.setdefault(hass.data[DOMAIN][entry.config_entry_id], []).append(
+                (entity_id, device_id, relay, state)
+            )
+
+    responses = await asyncio.gather(
+        *(
+            coordinator.thingsboard.set_relay_states(
+                [
+                    (device_id, relay, state)
+                    for _, device_id, relay, state in coordinator_commands
+                ]
+            )
+            for coordinator, coordinator_commands in commands.items()
+        )
+    )
+
+    results = []
+    for (coordinator, coordinator_commands), coordinator_responses in zip(
+        commands.items(), responses, strict=True
+    ):
+        confirm = []
+        for (entity_id, device_id, relay, state), response in zip(
+            coordinator_commands, coordinator_responses, strict=True
+        ):
+            if isinstance(response, Exception):
+                _LOGGER.error(
+                    "Failed to set relay %s for device %s: %s",
+                    relay,
+                    device_id,
+                    response,
+                )
+                results.append(
+                    {
+                        ATTR_ENTITY_ID: entity_id,
+                        "success": False,
+                        "error": str(response),
+                    }
+                )
+            else:
+                async_dispatcher_send(
+                    hass, SIGNAL_RELAY_SET.format(device_id, relay), state, response
+                )
+                confirm.append((device_id, relay, state))
+                results.append({ATTR_ENTITY_ID: entity_id, "success": True})
+
+        if confirm:
+            # Refresh the devices together, without delaying the response
+            hass.async_create_background_task(
+                async_confirm_relays(coordinator, confirm), "estudna confirm relays"
+            )
+
+    if call.return_response:
+        return {"results": results}
+    failed = [result[ATTR_ENTITY_ID] for result in results if not result["success"]]
+    if failed:
+        raise HomeAssistantError(f"Failed to set relays: {', '.join(failed)}")
+    return None
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register estudna services."""
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SET_RELAYS,
+        async_set_relays,
+        schema=SET_RELAYS_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
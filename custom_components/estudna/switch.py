@@ -4,60 +4,143 @@ from typing import Any
 
 from homeassistant.components.switch import SwitchEntity
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
-from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
-from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.util import dt as dt_util
 
-from . import get_device_id
-from .const import DOMAIN
+from .const import ATTR_LAST_READING, DOMAIN, SIGNAL_RELAY_SET
+from .entity import EStudnaEntity
+from .estudna import RELAY_KEYS
 
 _LOGGER = logging.getLogger(__name__)
 
-# Time to wait for relay to settle after state change
-RELAY_SETTLE_TIME = 2
 
-
-class EStudnaSwitch(CoordinatorEntity, SwitchEntity):
+class EStudnaSwitch(EStudnaEntity, SwitchEntity):
     """Representation of an eSTUDNA switch."""
 
     def __init__(self, coordinator, device: dict, relay: str):
         """Initialize the switch."""
-        super().__init__(coordinator)
-        self._device = device
+        super().__init__(coordinator, device)
+        self._state = coordinator.states[self._device_id]
         self._relay = relay
-        self._device_id = get_device_id(device)
+        self._attr_name = f"{self._device_name} {relay}"
         self._attr_unique_id = f"{self._device_id}_{relay}"
+        # State requested by RPC, shown until telemetry catches up
+        self._optimistic_state: bool | None = None
+        # Server timestamp of the relay reading known when the RPC returned
+        self._optimistic_ts: int | None = None
+        self._confirm_task: asyncio.Task | None = None
+        self._last_available: bool | None = None
 
     @property
-    def device_id(self) -> str:
-        """Return device ID."""
-        return self._device_id
+    def is_on(self):
+        """Return true if the switch is on."""
+        if self._optimistic_state is not None:
+            return self._optimistic_state
+        return self._state.relays.get(self._relay, False)
 
     @property
-    def device_info(self) -> DeviceInfo:
-        """Return device info."""
-        return DeviceInfo(
-            identifiers={(DOMAIN, self._device_id)},
-            model=self._device.get("type"),
-            manufacturer="SEA Praha",
-            name=self._device.get("name"),
+    def extra_state_attributes(self):
+        """Return time of the last reading."""
+        timestamp = self._state.relay_ts.get(self._relay)
+        if timestamp is None:
+            return None
+        return {ATTR_LAST_READING: dt_util.utc_from_timestamp(timestamp / 1000)}
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Drop optimistic state once telemetry confirms or overrides it.
+
+        Only readings newer than the one known after the RPC can override it,
+        timestamps of the server are not compared with the local clock. The
+        state is written only when something visible changed.
+        """
+        changed = self._relay in self._state.changed
+        if self._optimistic_state is not None:
+            state = self._state.relays.get(self._relay)
+            timestamp = self._state.relay_ts.get(self._relay)
+            if state == self._optimistic_state or (
+                timestamp is not None
+                and (self._optimistic_ts is None or timestamp > self._optimistic_ts)
+            ):
+                self._optimistic_state = None
+                changed = True
+        available = self.available
+        if changed or available != self._last_available:
+            self._last_available = available
+            super()._handle_coordinator_update()
+
+    async def async_added_to_hass(self) -> None:
+        """Listen for relays switched by the set_relays service."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass,
+                SIGNAL_RELAY_SET.format(self._device_id, self._relay),
+                self._async_handle_relay_set,
+            )
         )
 
-    @property
-    def name(self):
-        """Return the name of the switch."""
-        return f"{self._device.get('name')} {self._relay}"
+    async def async_will_remove_from_hass(self) -> None:
+        """Cancel pending confirmation."""
+        await super().async_will_remove_from_hass()
+        if self._confirm_task is not None:
+            self._confirm_task.cancel()
+
+    async def _async_confirm_state(self, refresh: bool):
+        """Wait until telemetry reflects the relay state.
+
+        The device is refreshed on every attempt unless somebody else does it.
+        """
+        for _attempt in range(self.coordinator.relay_confirm_attempts):
+            await asyncio.sleep(self.coordinator.relay_confirm_interval)
+            if refresh:
+                await self.coordinator.async_refresh_device(self._device_id)
+            if self._optimistic_state is None:
+                return
+        _LOGGER.debug(
+            "Relay %s for device %s did not report new state",
+            self._relay,
+            self._device_id,
+        )
+        # Fall back to the reported state
+        self._optimistic_state = None
+        self.async_write_ha_state()
+
+    @callback
+    def _async_apply_state(self, state: bool, response, refresh: bool = True):
+        """Show requested state until telemetry confirms it."""
+        reported = self.coordinator.thingsboard.parse_rpc_state(response)
+        if reported is not None and reported != state:
+            _LOGGER.warning(
+                "Relay %s for device %s reported %s instead of %s",
+                self._relay,
+                self._device_id,
+                reported,
+                state,
+            )
+            state = reported
+        self._optimistic_state = state
+        self._optimistic_ts = self._state.relay_ts.get(self._relay)
+        self.async_write_ha_state()
+
+        if self._confirm_task is not None:
+            self._confirm_task.cancel()
+        self._confirm_task = self.hass.async_create_background_task(
+            self._async_confirm_state(refresh),
+            f"estudna confirm {self._device_id} {self._relay}",
+        )
 
-    @property
-    def is_on(self):
-        """Return true if the switch is on."""
-        return self.coordinator.data.get(f"{self._device_id}_{self._relay}", False)
+    @callback
+    def _async_handle_relay_set(self, state: bool, response):
+        """Apply state set by the service, which refreshes the devices itself."""
+        self._async_apply_state(state, response, refresh=False)
 
     async def async_turn_on(self, **kwargs: Any) -> None:
         """Turn the switch on."""
         try:
-            await self.coordinator.thingsboard.set_relay_state(
+            response = await self.coordinator.thingsboard.set_relay_state(
                 self._device_id, self._relay, True
             )
         except Exception as err:
@@ -68,13 +151,12 @@ class EStudnaSwitch(CoordinatorEntity, SwitchEntity):
                 err,
             )
             raise
-        await asyncio.sleep(RELAY_SETTLE_TIME)
-        await self.coordinator.async_request_refresh()
+        self._async_apply_state(True, response)
 
     async def async_turn_off(self, **kwargs: Any) -> None:
         """Turn the switch off."""
         try:
-            await self.coordinator.thingsboard.set_relay_state(
+            response = await self.coordinator.thingsboard.set_relay_state(
                 self._device_id, self._relay, False
             )
         except Exception as err:
@@ -85,8 +167,7 @@ class EStudnaSwitch(CoordinatorEntity, SwitchEntity):
                 err,
             )
             raise
-        await asyncio.sleep(RELAY_SETTLE_TIME)
-        await self.coordinator.async_request_refresh()
+        self._async_apply_state(False, response)
 
 
 async def async_setup_entry(
@@ -97,10 +178,13 @@ async def async_setup_entry(
     """Set up eSTUDNA switches from config entry."""
     coordinator = hass.data[DOMAIN][config_entry.entry_id]
 
-    entities = [
-        EStudnaSwitch(coordinator, device, relay)
-        for device in coordinator.devices
-        for relay in ["OUT1", "OUT2"]
-    ]
+    @callback
+    def add_devices(devices: list[dict]):
+        async_add_entities(
+            EStudnaSwitch(coordinator, device, relay)
+            for device in devices
+            for relay in RELAY_KEYS
+        )
 
-    async_add_entities(entities)
+    add_devices(coordinator.devices)
+    config_entry.async_on_unload(coordinator.async_add_device_listener(add_devices))
@@ -0,0 +1 @@
+"""Tests of the eSTUDNA client, without Home Assistant."""
@@ -0,0 +1,28 @@
+"""Load modules of the integration without Home Assistant."""
+
+import importlib.util
+import sys
+from pathlib import Path
+from types import ModuleType
+
+COMPONENT = Path(__file__).parent.parent / "custom_components" / "estudna"
+
+
+def load_module(name: str) -> ModuleType:
+    """Load a module of the integration from its file.
+
+    Importing the package would import Home Assistant, so modules not
+    depending on it are loaded on their own, only once.
+    """
+    module_name = f"estudna_{name}"
+    if module_name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            module_name, COMPONENT / f"{name}.py"
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[module_name]
+
+
+estudna = load_module("estudna")
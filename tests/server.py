@@ -0,0 +1,214 @@
+"""Fake CML server to test the client against."""
+
+import asyncio
+import contextlib
+import json
+import time
+from collections import Counter, deque
+from collections.abc import AsyncIterator
+
+import aiohttp
+import jwt
+from aiohttp import web
+
+from .component import estudna
+
+SECRET = "fake-cml-server-token-signing-secret"
+CUSTOMER_ID = "customer-1"
+USER_ID = "user-1"
+
+
+class FakeServer:
+    """Minimal ThingsBoard server with a few devices."""
+
+    def __init__(self, devices: int = 2):
+        self.devices = {
+            f"device-{index}": {"ain1": "1.5", "dout1": "0", "dout2": "1"}
+            for index in range(devices)
+        }
+        # Requests per route
+        self.requests: Counter[str] = Counter()
+        # Delay of every response, in seconds
+        self.latency = 0.0
+        # Responses to return instead of handling the next requests
+        self.faults: deque[tuple[str | None, int, dict[str, str]]] = deque()
+        # Telemetry WebSockets with their subscriptions by device ID
+        self.websockets: dict[web.WebSocketResponse, dict[str, int]] = {}
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def start(self):
+        """Start serving, the address is available as url afterwards."""
+        app = web.Application(middlewares=[self._middleware])
+        app.add_routes(
+            [
+                web.post("/api/auth/login", self._login),
+                web.post("/apiv2/auth/login", self._login),
+                web.post("/api/auth/token", self._login),
+                web.get("/api/auth/user", self._user),
+                web.get(
+                    "/api/plugins/telemetry/DEVICE/{device}/values/timeseries",
+                    self._timeseries,
+                ),
+                web.get("/apiv2/device/{device}/latest", self._latest_v2),
+                web.post("/api/rpc/twoway/{device}", self._rpc),
+                web.get("/api/ws/plugins/telemetry", self._websocket),
+            ]
+        )
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # noqa: SLF001
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        """Stop serving."""
+        await self.close_websockets()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def fail_next(
+        self,
+        status: int,
+        count: int = 1,
+        headers: dict[str, str] | None = None,
+        route: str | None = None,
+    ):
+        """Respond to the next requests, optionally of a route, with an error status."""
+        self.faults.extend((route, status, headers or {}) for _index in range(count))
+
+    @staticmethod
+    def _check_token(token: str):
+        try:
+            jwt.decode(token, SECRET, algorithms=["HS256"])
+        except jwt.InvalidTokenError as err:
+            raise web.HTTPUnauthorized from err
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        route = request.match_info.route.resource.canonical
+        self.requests[route] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for fault in self.faults:
+            if fault[0] in {None, route}:
+                self.faults.remove(fault)
+                _route, status, headers = fault
+                return web.json_response(
+                    {"status": status}, status=status, headers=headers
+                )
+        if request.path.endswith("/ws/plugins/telemetry"):
+            self._check_token(request.query.get("token", ""))
+        elif not request.path.endswith(("/auth/login", "/auth/token")):
+            header = request.headers.get("X-Authorization", "")
+            self._check_token(header.removeprefix("Bearer "))
+        return await handler(request)
+
+    async def _login(self, request: web.Request) -> web.Response:
+        now = int(time.time())
+        token = jwt.encode({"sub": USER_ID, "iat": now, "exp": now + 900}, SECRET)
+        return web.json_response(
+            {"token": token, "refreshToken": token, "user_id": USER_ID}
+        )
+
+    async def _user(self, request: web.Request) -> web.Response:
+        return web.json_response({"customerId": {"id": CUSTOMER_ID}})
+
+    def _device(self, request: web.Request) -> dict[str, str]:
+        try:
+            return self.devices[request.match_info["device"]]
+        except KeyError as err:
+            raise web.HTTPNotFound from err
+
+    async def _timeseries(self, request: web.Request) -> web.Response:
+        values = self._device(request)
+        keys = request.query.get("keys", "").split(",")
+        now = int(time.time() * 1000)
+        return web.json_response(
+            {
+                key: [{"ts": now, "value": value}]
+                for key, value in values.items()
+                if key in keys
+            }
+        )
+
+    async def _latest_v2(self, request: web.Request) -> web.Response:
+        values = self._device(request)
+        now = int(time.time() * 1000)
+        # eSTUDNA2 nests JSON encoded values in the response
+        return web.json_response(
+            {
+                key: [{"ts": now, "value": json.dumps({"str": value})}]
+                for key, value in values.items()
+            }
+        )
+
+    async def _rpc(self, request: web.Request) -> web.Response:
+        values = self._device(request)
+        body = await request.json()
+        key = {"setDout1": "dout1", "setDout2": "dout2"}.get(body.get("method"))
+        if key is None:
+            raise web.HTTPBadRequest
+        values[key] = "1" if body.get("params") else "0"
+        return web.json_response(bool(body.get("params")))
+
+    async def _websocket(self, request: web.Request) -> web.WebSocketResponse:
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        subscriptions = self.websockets[websocket] = {}
+        try:
+            async for message in websocket:
+                for command in message.json().get("tsSubCmds", []):
+                    subscriptions[command["entityId"]] = command["cmdId"]
+                    if command["entityId"] in self.devices:
+                        await self.push(command["entityId"])
+        finally:
+            del self.websockets[websocket]
+        return websocket
+
+    async def push(self, device_id: str):
+        """Send current values of a device to its subscribers."""
+        now = int(time.time() * 1000)
+        data = {key: [[now, value]] for key, value in self.devices[device_id].items()}
+        await self.send_raw({"errorCode": 0, "errorMsg": None, "data": data}, device_id)
+
+    async def send_raw(self, payload: dict, device_id: str | None = None):
+        """Send a payload to the subscribers of a device, or to all of them."""
+        for websocket, subscriptions in list(self.websockets.items()):
+            if device_id is None:
+                await websocket.send_json(payload)
+            elif device_id in subscriptions:
+                await websocket.send_json(
+                    {"subscriptionId": subscriptions[device_id], **payload}
+                )
+
+    async def close_websockets(self):
+        """Disconnect all telemetry WebSockets."""
+        for websocket in list(self.websockets):
+            await websocket.close()
+
+
+@contextlib.asynccontextmanager
+async def connect(
+    device_type: str = "estudna", devices: int = 2, **kwargs
+) -> AsyncIterator[tuple[FakeServer, estudna.ThingsBoard]]:
+    """Start a server and yield it with a client logged in to it.
+
+    Keyword arguments are passed to the client.
+    """
+    server = FakeServer(devices)
+    await server.start()
+    session = aiohttp.ClientSession()
+    thingsboard = estudna.ThingsBoard(
+        device_type=device_type, session=session, **kwargs
+    )
+    thingsboard.server = server.url
+    try:
+        await thingsboard.login("user", "password")
+        yield server, thingsboard
+    finally:
+        await thingsboard.close()
+        await session.close()
+        await server.stop()
@@ -0,0 +1,120 @@
+"""Tests of decoding telemetry of both API dialects."""
+
+import asyncio
+import copy
+import json
+from pathlib import Path
+
+import pytest
+
+from .component import estudna
+from .server import connect
+
+FIXTURES = Path(__file__).parent / "fixtures"
+# Recorded responses of /api/plugins/telemetry/DEVICE/{id}/values/timeseries
+TIMESERIES = json.loads((FIXTURES / "timeseries.json").read_text())
+# Recorded responses of /apiv2/device/{id}/latest
+LATEST_V2 = json.loads((FIXTURES / "latest_v2.json").read_text())
+
+
+@pytest.mark.parametrize(
+    ("device_type", "values"),
+    [("estudna", TIMESERIES), ("estudna2", LATEST_V2)],
+)
+def test_decode(device_type, values):
+    thingsboard = estudna.ThingsBoard(device_type=device_type)
+    assert thingsboard.decode_values(values) == {
+        "ain1": (1.842, 1760688000123),
+        "dout1": (True, 1760687940456),
+        "dout2": (False, 1760601540789),
+    }
+
+
+def test_decode_keys():
+    thingsboard = estudna.ThingsBoard(device_type="estudna2")
+    assert thingsboard.decode_values(LATEST_V2, ("dout2",)) == {
+        "dout2": (False, 1760601540789)
+    }
+
+
+@pytest.mark.parametrize("device_type", ["estudna", "estudna2"])
+def test_decode_plain_strings(device_type):
+    thingsboard = estudna.ThingsBoard(device_type=device_type)
+    values = {
+        "ain1": [{"ts": 1, "value": "0.5"}],
+        "dout1": [{"ts": 2, "value": "true"}],
+        "dout2": [{"ts": 3, "value": "False"}],
+    }
+    assert thingsboard.decode_values(values) == {
+        "ain1": (0.5, 1),
+        "dout1": (True, 2),
+        "dout2": (False, 3),
+    }
+
+
+@pytest.mark.parametrize(
+    ("device_type", "values"),
+    [("estudna", TIMESERIES), ("estudna2", LATEST_V2)],
+)
+def test_decode_missing(device_type, values):
+    thingsboard = estudna.ThingsBoard(device_type=device_type)
+    values = copy.deepcopy(values)
+    del values["dout1"]
+    values["dout2"] = []
+    assert thingsboard.decode_values(values) == {"ain1": (1.842, 1760688000123)}
+    assert thingsboard.decode_values({}) == {}
+    assert thingsboard.parse_estudna_level({}) is None
+    assert thingsboard.parse_relay_state({}, "OUT1") is False
+    assert thingsboard.parse_timestamp({}, "ain1") is None
+
+
+@pytest.mark.parametrize(
+    ("device_type", "value"),
+    [
+        ("estudna", "n/a"),
+        ("estudna", None),
+        ("estudna", ""),
+        ("estudna2", '{"str": "n/a"}'),
+        ("estudna2", '{"str": '),
+        ("estudna2", "{}"),
+    ],
+)
+def test_decode_unparsable_level(device_type, value):
+    thingsboard = estudna.ThingsBoard(device_type=device_type)
+    values = {"ain1": [{"ts": 1760688000123, "value": value}]}
+    assert thingsboard.decode_values(values) == {"ain1": (None, 1760688000123)}
+
+
+def test_decode_missing_timestamp():
+    thingsboard = estudna.ThingsBoard(device_type="estudna")
+    assert thingsboard.decode_values({"ain1": [{"value": "2"}]}) == {
+        "ain1": (2.0, None)
+    }
+
+
+@pytest.mark.parametrize(
+    ("device_type", "values"),
+    [("estudna", TIMESERIES), ("estudna2", LATEST_V2)],
+)
+def test_parse(device_type, values):
+    thingsboard = estudna.ThingsBoard(device_type=device_type)
+    assert thingsboard.parse_estudna_level(values) == 1.842
+    assert thingsboard.parse_relay_state(values, "OUT1") is True
+    assert thingsboard.parse_relay_state(values, "OUT2") is False
+    assert thingsboard.parse_timestamp(values, "dout1") == 1760687940456
+
+
+@pytest.mark.parametrize("device_type", ["estudna", "estudna2"])
+def test_snapshot(device_type):
+    async def run():
+        async with connect(device_type) as (_server, thingsboard):
+            values = await thingsboard.get_device_snapshot("device-0")
+            decoded = thingsboard.decode_values(values)
+            assert {key: value for key, (value, _ts) in decoded.items()} == {
+                "ain1": 1.5,
+                "dout1": False,
+                "dout2": True,
+            }
+            assert all(isinstance(ts, int) for _value, ts in decoded.values())
+
+    asyncio.run(run())
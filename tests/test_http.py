@@ -0,0 +1,208 @@
+"""Tests of retrying failed requests and the circuit breaker."""
+
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+from .component import estudna
+from .server import connect
+
+TIMESERIES = "/api/plugins/telemetry/DEVICE/{device}/values/timeseries"
+RPC = "/api/rpc/twoway/{device}"
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(estudna, "HTTP_RETRY_BACKOFF", 0.01)
+    # Do not share circuit breakers between tests
+    monkeypatch.setattr(estudna, "_CIRCUIT_BREAKERS", {})
+
+
+@pytest.mark.parametrize("status", sorted(estudna.HTTP_RETRY_STATUSES))
+def test_retry_get(status):
+    async def run():
+        async with connect() as (server, thingsboard):
+            server.requests.clear()
+            server.fail_next(status, 2)
+            values = await thingsboard.get_device_snapshot("device-0")
+            assert thingsboard.parse_relay_state(values, "OUT2") is True
+            assert server.requests[TIMESERIES] == 3
+            assert not thingsboard.circuit_open
+
+    asyncio.run(run())
+
+
+def test_retry_after():
+    async def run():
+        async with connect() as (server, thingsboard):
+            server.requests.clear()
+            server.fail_next(429, headers={"Retry-After": "0.3"})
+            start = time.monotonic()
+            await thingsboard.get_device_snapshot("device-0")
+            assert time.monotonic() - start >= 0.3
+            assert server.requests[TIMESERIES] == 2
+
+    asyncio.run(run())
+
+
+def test_retry_without_retry_after():
+    async def run():
+        async with connect() as (server, thingsboard):
+            server.requests.clear()
+            server.fail_next(429)
+            await thingsboard.get_device_snapshot("device-0")
+            assert server.requests[TIMESERIES] == 2
+
+    asyncio.run(run())
+
+
+def test_retries_exhausted():
+    async def run():
+        async with connect(retries=2) as (server, thingsboard):
+            server.requests.clear()
+            server.fail_next(503, 3)
+            with pytest.raises(aiohttp.ClientResponseError) as excinfo:
+                await thingsboard.get_device_snapshot("device-0")
+            assert excinfo.value.status == 503
+            assert server.requests[TIMESERIES] == 3
+
+    asyncio.run(run())
+
+
+def test_no_retry_client_error():
+    async def run():
+        async with connect() as (server, thingsboard):
+            server.requests.clear()
+            with pytest.raises(aiohttp.ClientResponseError) as excinfo:
+                await thingsboard.get_device_snapshot("missing")
+            assert excinfo.value.status == 404
+            assert server.requests[TIMESERIES] == 1
+
+    asyncio.run(run())
+
+
+def test_no_retry_post():
+    async def run():
+        async with connect() as (server, thingsboard):
+            server.requests.clear()
+            server.fail_next(503)
+            with pytest.raises(aiohttp.ClientResponseError):
+                await thingsboard.set_relay_state("device-0", "OUT1", True)
+            assert server.requests[RPC] == 1
+            assert server.devices["device-0"]["dout1"] == "0"
+
+    asyncio.run(run())
+
+
+def test_circuit_breaker():
+    async def run():
+        async with connect(retries=0) as (server, thingsboard):
+            breaker = estudna.get_circuit_breaker(server.url)
+            breaker.timeout = 0.2
+            server.requests.clear()
+            server.fail_next(503, estudna.CIRCUIT_BREAKER_THRESHOLD)
+            for _attempt in range(estudna.CIRCUIT_BREAKER_THRESHOLD):
+                assert not thingsboard.circuit_open
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await thingsboard.get_device_snapshot("device-0")
+            assert thingsboard.circuit_open
+
+            # No requests are sent while the circuit is open
+            with pytest.raises(estudna.CircuitOpenError):
+                await thingsboard.get_device_snapshot("device-0")
+            assert server.requests[TIMESERIES] == estudna.CIRCUIT_BREAKER_THRESHOLD
+
+            # A single failure after the timeout opens the circuit again
+            await asyncio.sleep(0.2)
+            assert not thingsboard.circuit_open
+            server.fail_next(503)
+            with pytest.raises(aiohttp.ClientResponseError):
+                await thingsboard.get_device_snapshot("device-0")
+            assert thingsboard.circuit_open
+
+            # Success after the timeout closes it
+            await asyncio.sleep(0.2)
+            await thingsboard.get_device_snapshot("device-0")
+            assert not thingsboard.circuit_open
+            assert breaker.failures == 0
+
+    asyncio.run(run())
+
+
+def test_circuit_breaker_stops_retries():
+    async def run():
+        async with connect(retries=10) as (server, thingsboard):
+            server.requests.clear()
+            server.fail_next(503, 20)
+            with pytest.raises(aiohttp.ClientResponseError):
+                await thingsboard.get_device_snapshot("device-0")
+            assert thingsboard.circuit_open
+            assert server.requests[TIMESERIES] == estudna.CIRCUIT_BREAKER_THRESHOLD
+
+    asyncio.run(run())
+
+
+def test_client_errors_keep_circuit_closed():
+    async def run():
+        async with connect() as (_server, thingsboard):
+            for _attempt in range(estudna.CIRCUIT_BREAKER_THRESHOLD):
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await thingsboard.get_device_snapshot("missing")
+            assert not thingsboard.circuit_open
+
+    asyncio.run(run())
+
+
+def test_rpc_failures_keep_circuit_closed():
+    async def run():
+        async with connect(timeout=0.1) as (server, thingsboard):
+            server.fail_next(504, estudna.CIRCUIT_BREAKER_THRESHOLD)
+            for _attempt in range(estudna.CIRCUIT_BREAKER_THRESHOLD):
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await thingsboard.set_relay_state("device-0", "OUT1", True)
+            server.latency = 0.5
+            for _attempt in range(estudna.CIRCUIT_BREAKER_THRESHOLD):
+                with pytest.raises(TimeoutError):
+                    await thingsboard.set_relay_state("device-0", "OUT1", True)
+            assert not thingsboard.circuit_open
+            assert estudna.get_circuit_breaker(server.url).failures == 0
+
+    asyncio.run(run())
+
+
+def test_timeout():
+    async def run():
+        async with connect(timeout=0.2) as (server, thingsboard):
+            server.latency = 1
+            start = time.monotonic()
+            with pytest.raises(TimeoutError):
+                await thingsboard.get_device_snapshot("device-0")
+            assert time.monotonic() - start < 0.5
+            # The shared request times out on its own right after the caller
+            await asyncio.sleep(0.05)
+            # The server did not respond in time
+            assert estudna.get_circuit_breaker(server.url).failures == 1
+
+    asyncio.run(run())
+
+
+def test_rate_limit_timeout_keeps_circuit_closed(monkeypatch):
+    async def run():
+        async with connect(timeout=0.05) as (server, thingsboard):
+            # Nothing is released from the queue any more
+            monkeypatch.setitem(
+                estudna._SCHEDULERS,  # noqa: SLF001
+                server.url,
+                estudna.RequestScheduler(rate=1, burst=0),
+            )
+            server.requests.clear()
+            for _attempt in range(estudna.CIRCUIT_BREAKER_THRESHOLD):
+                with pytest.raises(TimeoutError):
+                    await thingsboard.get_device_snapshot("device-0")
+            assert not thingsboard.circuit_open
+            assert estudna.get_circuit_breaker(server.url).failures == 0
+            assert server.requests[TIMESERIES] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,44 @@
+"""Tests of refreshing tokens and logging in again."""
+
+import asyncio
+
+import aiohttp
+import pytest
+
+from .server import connect
+
+
+def test_refresh():
+    async def run():
+        async with connect() as (server, thingsboard):
+            await thingsboard.refresh_token()
+            assert server.requests["/api/auth/token"] == 1
+            assert thingsboard.stats.logins == 1
+
+    asyncio.run(run())
+
+
+def test_login_again():
+    async def run():
+        async with connect() as (server, thingsboard):
+            server.fail_next(401, route="/api/auth/token")
+            await thingsboard.refresh_token()
+            assert server.requests["/api/auth/login"] == 2
+            assert server.requests["/api/auth/user"] == 2
+            assert thingsboard.stats.logins == 2
+
+    asyncio.run(run())
+
+
+def test_login_again_rejected():
+    async def run():
+        async with connect() as (server, thingsboard):
+            server.fail_next(401, route="/api/auth/token")
+            server.fail_next(401, route="/api/auth/user")
+            # Fails instead of waiting for the refresh in progress
+            async with asyncio.timeout(1):
+                with pytest.raises(aiohttp.ClientResponseError) as excinfo:
+                    await thingsboard.refresh_token()
+            assert excinfo.value.status == 401
+
+    asyncio.run(run())
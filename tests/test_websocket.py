@@ -0,0 +1,117 @@
+"""Tests of live telemetry updates over WebSocket."""
+
+import asyncio
+import logging
+
+import pytest
+
+from .component import estudna
+from .server import connect
+
+
+@pytest.fixture(autouse=True)
+def fast_reconnect(monkeypatch):
+    monkeypatch.setattr(estudna, "WEBSOCKET_BACKOFF_MIN", 0.01)
+
+
+class Updates:
+    """Collect updates passed to the subscription callback."""
+
+    def __init__(self):
+        self.updates: list[tuple[str, dict]] = []
+        self._changed = asyncio.Event()
+
+    def __call__(self, device_id: str, values: dict):
+        self.updates.append((device_id, values))
+        self._changed.set()
+
+    async def wait(self, count: int):
+        """Wait until the given number of updates was received."""
+        async with asyncio.timeout(5):
+            while len(self.updates) < count:
+                self._changed.clear()
+                await self._changed.wait()
+
+
+async def subscribe(server, thingsboard, updates: Updates):
+    subscription = estudna.TelemetrySubscription(
+        thingsboard, list(server.devices), updates
+    )
+    subscription.start()
+    # Every subscribed device reports its current values
+    await updates.wait(len(server.devices))
+    return subscription
+
+
+def test_updates():
+    async def run():
+        updates = Updates()
+        async with connect() as (server, thingsboard):
+            subscription = await subscribe(server, thingsboard, updates)
+            server.devices["device-1"]["dout1"] = "1"
+            await server.push("device-1")
+            await updates.wait(3)
+            await subscription.stop()
+
+        assert {device_id for device_id, _values in updates.updates} == {
+            "device-0",
+            "device-1",
+        }
+        device_id, values = updates.updates[-1]
+        assert device_id == "device-1"
+        assert set(values) == set(estudna.TELEMETRY_KEYS)
+        assert thingsboard.parse_relay_state(values, "OUT1") is True
+
+    asyncio.run(run())
+
+
+def test_reconnect():
+    async def run():
+        updates = Updates()
+        async with connect() as (server, thingsboard):
+            subscription = await subscribe(server, thingsboard, updates)
+            await server.close_websockets()
+            # Subscribes again after reconnecting
+            await updates.wait(4)
+            await server.push("device-0")
+            await updates.wait(5)
+            await subscription.stop()
+        assert server.requests["/api/ws/plugins/telemetry"] == 2
+
+    asyncio.run(run())
+
+
+def test_unexpected_payload(caplog):
+    async def run():
+        updates = Updates()
+        async with connect() as (server, thingsboard):
+            subscription = await subscribe(server, thingsboard, updates)
+            for count in (4, 6):
+                await server.send_raw({"subscriptionId": 1, "data": ["broken"]})
+                # The broken payload drops the connection, not the subscription
+                await updates.wait(count)
+            await subscription.stop()
+        assert server.requests["/api/ws/plugins/telemetry"] == 3
+
+    with caplog.at_level(logging.DEBUG):
+        asyncio.run(run())
+    # Repeated failures are reported only once
+    warnings = [
+        record for record in caplog.records if record.levelno == logging.WARNING
+    ]
+    assert len(warnings) == 1
+    assert warnings[0].exc_info is not None
+
+
+def test_stop_while_reconnecting():
+    async def run():
+        async with connect() as (server, thingsboard):
+            await server.stop()
+            subscription = estudna.TelemetrySubscription(
+                thingsboard, list(server.devices), Updates()
+            )
+            subscription.start()
+            await asyncio.sleep(0.05)
+            await subscription.stop()
+
+    asyncio.run(run())